@@ -1,15 +1,51 @@
 from __future__ import annotations
 
+import asyncio
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
 
+from app.core.config import get_settings
+
+# bcrypt releases the GIL while hashing, so a dedicated pool lets concurrent
+# logins spread across cores instead of stalling the event loop.
+_bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
+_BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+_BCRYPT_HASH_LENGTH = 60
+
+
+def _is_bcrypt_hash(password_hash: str) -> bool:
+  return len(password_hash) == _BCRYPT_HASH_LENGTH and password_hash[:4] in _BCRYPT_PREFIXES
+
 
 def hash_password(password: str) -> str:
-  salt = bcrypt.gensalt()
+  salt = bcrypt.gensalt(rounds=get_settings().bcrypt_cost)
   return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
 
 
 def verify_password(password: str, password_hash: str) -> bool:
+  if not _is_bcrypt_hash(password_hash):
+    return False
+  stored = password_hash.encode("utf-8")
   try:
-    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+    expected = bcrypt.hashpw(password.encode("utf-8"), stored)
   except ValueError:
     return False
+  return hmac.compare_digest(expected, stored)
+
+
+async def hash_password_async(password: str) -> str:
+  return await asyncio.get_running_loop().run_in_executor(_bcrypt_pool, hash_password, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+  if not _is_bcrypt_hash(password_hash):
+    return False
+  return await asyncio.get_running_loop().run_in_executor(
+    _bcrypt_pool,
+    verify_password,
+    password,
+    password_hash,
+  )
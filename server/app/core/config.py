@@ -1,4 +1,4 @@
-from functools import lru_cache
+from functools import cached_property
 from pathlib import Path
 from typing import Literal
 
@@ -14,7 +14,7 @@ CreativityMode = Literal["user", "ai", "blend"]
 
 
 class Settings(BaseSettings):
-  model_config = SettingsConfigDict(env_file=ENV_PATH, env_file_encoding="utf-8", extra="ignore")
+  model_config = SettingsConfigDict(extra="ignore")
 
   genai_api_key: str = Field(..., env="GENAI_API_KEY")
   genai_model: str = Field("gemini-3-pro-preview", env="GENAI_MODEL")
@@ -36,6 +36,7 @@ class Settings(BaseSettings):
   smtp_use_starttls: bool = Field(True, env="SMTP_USE_STARTTLS")
   reset_token_hours: int = Field(2, ge=1, le=24, env="RESET_TOKEN_HOURS")
   auth_rate_limit_per_minute: int = Field(20, ge=1, le=120, env="AUTH_RATE_LIMIT_PER_MINUTE")
+  bcrypt_cost: int = Field(10, ge=4, le=16, env="BCRYPT_COST")
   allow_unauthenticated_generate: bool = Field(
     False,
     env="ALLOW_UNAUTHENTICATED_GENERATE",
@@ -44,8 +45,22 @@ class Settings(BaseSettings):
   midtrans_is_production: bool = Field(False, env="MIDTRANS_IS_PRODUCTION")
   midtrans_server_key: str = Field("", env="MIDTRANS_SERVER_KEY")
   midtrans_client_key: str = Field("", env="MIDTRANS_CLIENT_KEY")
+  rembg_providers: str = Field("CPUExecutionProvider", env="REMBG_PROVIDERS")
+
+  @cached_property
+  def cors_origins(self) -> tuple[str, ...]:
+    return tuple(origin.strip() for origin in self.cors_allowed_origins.split(",") if origin.strip())
+
+  @cached_property
+  def rembg_provider_list(self) -> tuple[str, ...]:
+    return tuple(provider.strip() for provider in self.rembg_providers.split(",") if provider.strip())
+
+
+_SETTINGS: Settings | None = None
 
 
-@lru_cache(maxsize=1)
 def get_settings() -> Settings:
-  return Settings()
+  global _SETTINGS
+  if _SETTINGS is None:
+    _SETTINGS = Settings()
+  return _SETTINGS
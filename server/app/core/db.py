@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
+import asyncio
+import base64
+import os
+import queue
 import sqlite3
 import hashlib
 import secrets
-from typing import Iterator, Optional
-from uuid import uuid4
+import threading
+import time
+from typing import Any, Iterator, Optional
 
 BASE_DIR = Path(__file__).resolve().parents[3]
 DATA_DIR = BASE_DIR / "data"
@@ -14,9 +21,247 @@ DB_PATH = DATA_DIR / "odin.db"
 IMAGES_DIR = DATA_DIR / "images"
 SLIDES_DIR = DATA_DIR / "slides"
 
+# Bump whenever _maybe_migrate learns a new step so existing databases rerun it.
+_SCHEMA_VERSION = 2
+
+_CONNECTION_PRAGMAS = """
+PRAGMA busy_timeout=5000;
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA foreign_keys=ON;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-20000;
+"""
+
+_SCHEMA_TABLES = """
+CREATE TABLE IF NOT EXISTS projects (
+  id TEXT PRIMARY KEY,
+  owner_id TEXT NOT NULL,
+  name TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  last_prompt TEXT,
+  last_slide_context TEXT,
+  slide_image_path TEXT,
+  generation_count INTEGER NOT NULL DEFAULT 0,
+  UNIQUE(owner_id, name)
+);
+CREATE TABLE IF NOT EXISTS generations (
+  id TEXT PRIMARY KEY,
+  project_id TEXT NOT NULL,
+  image_path TEXT NOT NULL,
+  description TEXT NOT NULL,
+  aspect_ratio TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS users (
+  id TEXT PRIMARY KEY,
+  email TEXT NOT NULL UNIQUE,
+  username TEXT NOT NULL UNIQUE,
+  password_hash TEXT NOT NULL,
+  name TEXT,
+  email_verified INTEGER NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS password_reset_tokens (
+  id TEXT PRIMARY KEY,
+  user_id TEXT NOT NULL,
+  token_hash TEXT NOT NULL UNIQUE,
+  created_at TEXT NOT NULL,
+  expires_at TEXT NOT NULL,
+  used_at TEXT,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS sessions (
+  id TEXT PRIMARY KEY,
+  user_id TEXT NOT NULL,
+  token_hash TEXT NOT NULL UNIQUE,
+  created_at TEXT NOT NULL,
+  expires_at TEXT NOT NULL,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS payment_orders (
+  order_id TEXT PRIMARY KEY,
+  user_id TEXT NOT NULL,
+  idempotency_key TEXT,
+  plan_id TEXT NOT NULL,
+  gross_amount INTEGER NOT NULL,
+  currency TEXT NOT NULL,
+  customer_name TEXT NOT NULL,
+  customer_email TEXT NOT NULL,
+  customer_phone TEXT NOT NULL,
+  status TEXT NOT NULL,
+  snap_token TEXT,
+  transaction_status TEXT,
+  fraud_status TEXT,
+  status_code TEXT,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  paid_at TEXT,
+  last_notification_json TEXT,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS payment_events (
+  id TEXT PRIMARY KEY,
+  order_id TEXT,
+  event_type TEXT NOT NULL,
+  payload_json TEXT NOT NULL,
+  received_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+  user_id TEXT PRIMARY KEY,
+  plan_id TEXT NOT NULL,
+  status TEXT NOT NULL,
+  order_id TEXT,
+  started_at TEXT,
+  current_period_end TEXT,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS subscription_periods (
+  id TEXT PRIMARY KEY,
+  user_id TEXT NOT NULL,
+  order_id TEXT NOT NULL,
+  plan_id TEXT NOT NULL,
+  status TEXT NOT NULL,
+  period_start TEXT NOT NULL,
+  period_end TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+"""
+
+_SCHEMA_INDEXES = """
+DROP INDEX IF EXISTS idx_projects_owner_id;
+CREATE INDEX IF NOT EXISTS idx_projects_owner_updated ON projects(owner_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_generations_project_id ON generations(project_id);
+CREATE INDEX IF NOT EXISTS idx_generations_created_at ON generations(created_at);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+CREATE INDEX IF NOT EXISTS idx_sessions_token_covering ON sessions(token_hash, expires_at, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+CREATE INDEX IF NOT EXISTS idx_reset_tokens_user_id ON password_reset_tokens(user_id);
+CREATE INDEX IF NOT EXISTS idx_reset_tokens_expires_at ON password_reset_tokens(expires_at);
+CREATE INDEX IF NOT EXISTS idx_payment_orders_status ON payment_orders(status);
+CREATE INDEX IF NOT EXISTS idx_payment_orders_created_at ON payment_orders(created_at);
+CREATE INDEX IF NOT EXISTS idx_payment_orders_user_id ON payment_orders(user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_orders_idempotency
+  ON payment_orders(user_id, idempotency_key)
+  WHERE idempotency_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_payment_events_order_id ON payment_events(order_id);
+CREATE INDEX IF NOT EXISTS idx_payment_events_order_received ON payment_events(order_id, received_at);
+DROP INDEX IF EXISTS idx_subscription_periods_user_id;
+CREATE INDEX IF NOT EXISTS idx_subscription_periods_user_status_end
+  ON subscription_periods(user_id, status, period_end);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_subscription_periods_order_id ON subscription_periods(order_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_status ON subscriptions(status);
+"""
+
+_SCHEMA_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS trg_generations_count_insert AFTER INSERT ON generations
+BEGIN
+  UPDATE projects SET generation_count = generation_count + 1 WHERE id = NEW.project_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_generations_count_delete AFTER DELETE ON generations
+BEGIN
+  UPDATE projects SET generation_count = generation_count - 1 WHERE id = OLD.project_id;
+END;
+"""
+
+_PAYMENT_ORDER_COLUMNS = (
+  "order_id",
+  "user_id",
+  "idempotency_key",
+  "plan_id",
+  "gross_amount",
+  "currency",
+  "customer_name",
+  "customer_email",
+  "customer_phone",
+  "status",
+  "snap_token",
+  "transaction_status",
+  "fraud_status",
+  "status_code",
+  "created_at",
+  "updated_at",
+  "paid_at",
+  "last_notification_json",
+)
+_PAYMENT_ORDER_COLUMN_LIST = ", ".join(_PAYMENT_ORDER_COLUMNS)
+_PAYMENT_ORDER_INSERT_SQL = (
+  f"INSERT INTO payment_orders ({_PAYMENT_ORDER_COLUMN_LIST}) "
+  f"VALUES ({', '.join(':' + column for column in _PAYMENT_ORDER_COLUMNS)})"
+)
+_PAYMENT_ORDER_SELECT_SQL = f"SELECT {_PAYMENT_ORDER_COLUMN_LIST} FROM payment_orders"
+
+_POOL_SIZE = max(8, os.cpu_count() or 1)
+_pool: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(maxsize=_POOL_SIZE)
+
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+_fadvise = getattr(os, "posix_fadvise", None)
+# Image writes fsync, so keep them off the shared request threadpool.
+_IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="disk-io")
+_dir_fds: dict[Path, int] = {}
+
+_TOKEN_BYTES = 32
+# Length of _new_token(): unpadded base64 of the random bytes.
+_TOKEN_LENGTH = -(-_TOKEN_BYTES * 4 // 3)
+
+# One getrandom() call refills enough bytes for ~100 tokens or ids.
+_RANDOM_REFILL_BYTES = 4096
+_random_pool = bytearray()
+_random_lock = threading.Lock()
+
+_SESSION_CACHE_SIZE = 10_000
+# Bounds how long another worker's session deletion can go unnoticed here.
+_SESSION_CACHE_TTL = 30.0
+# token_hash -> (user_id, expires_at, cached_at), evicted oldest-first.
+_session_cache: dict[str, tuple[str, str, float]] = {}
+# Lookups read the dict bare; every mutation and full scan holds the lock.
+_session_lock = threading.Lock()
+
+
+_sha256 = hashlib.sha256
+_CROCKFORD = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", b"0123456789ABCDEFGHJKMNPQRSTVWXYZ")
+
+
+def _reset_random_pool() -> None:
+  # A forked worker must never hand out bytes its parent already buffered.
+  global _random_lock
+  _random_lock = threading.Lock()
+  _random_pool.clear()
+
+
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=_reset_random_pool)
+
+
+def _random_bytes(size: int) -> bytes:
+  with _random_lock:
+    if len(_random_pool) < size:
+      _random_pool.extend(os.urandom(_RANDOM_REFILL_BYTES))
+    data = bytes(_random_pool[:size])
+    del _random_pool[:size]
+  return data
+
+
+def _new_token() -> str:
+  return base64.urlsafe_b64encode(_random_bytes(_TOKEN_BYTES)).rstrip(b"=").decode("ascii")
+
+
+def new_id() -> str:
+  # ULID: 48-bit millisecond timestamp + 80 random bits in Crockford base32, so
+  # primary keys sort by creation time and inserts land on the rightmost pages.
+  raw = (time.time_ns() // 1_000_000).to_bytes(6, "big") + _random_bytes(10)
+  return base64.b32encode(bytes(4) + raw).translate(_CROCKFORD)[6:].decode("ascii")
+
 
 def _hash_token(token: str) -> str:
-  return hashlib.sha256(token.encode("utf-8")).hexdigest()
+  return _sha256(token.encode()).hexdigest()
 
 
 def init_db() -> None:
@@ -25,40 +270,124 @@ def init_db() -> None:
   SLIDES_DIR.mkdir(parents=True, exist_ok=True)
   conn = sqlite3.connect(DB_PATH)
   try:
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA busy_timeout=5000;")
+    conn.executescript(_CONNECTION_PRAGMAS)
+    conn.executescript(f"BEGIN;\n{_SCHEMA_TABLES}COMMIT;")
+    _maybe_migrate(conn)
+    conn.commit()
+    conn.executescript(f"BEGIN;\n{_SCHEMA_INDEXES}{_SCHEMA_TRIGGERS}COMMIT;")
+    conn.execute("PRAGMA optimize")
+  finally:
+    conn.close()
+
+
+def _dict_factory(cursor: sqlite3.Cursor, row: tuple) -> dict[str, Any]:
+  return {column[0]: row[index] for index, column in enumerate(cursor.description)}
+
+
+def _tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+  cursor = conn.cursor()
+  cursor.row_factory = None
+  return cursor
+
+
+def _connect() -> sqlite3.Connection:
+  conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+  conn.row_factory = _dict_factory
+  conn.executescript(_CONNECTION_PRAGMAS)
+  return conn
+
+
+def _release(conn: sqlite3.Connection) -> None:
+  try:
+    _pool.put_nowait(conn)
+  except queue.Full:
+    conn.close()
+
+
+def close_pool() -> None:
+  while True:
+    try:
+      conn = _pool.get_nowait()
+    except queue.Empty:
+      return
+    conn.close()
+
+
+def warm_pool(size: int = 4) -> None:
+  # Opens connections before the first requests arrive and runs the hot
+  # lookups once on each, so their statements are already in the cache.
+  conns = [_connect() for _ in range(min(size, _POOL_SIZE))]
+  for conn in conns:
+    get_user_by_email(conn, "")
+    get_user_id_for_token(conn, "_" * _TOKEN_LENGTH, "")
+    list_projects(conn, "")
+    get_project(conn, "", "")
+    get_generation_image_path_for_user(conn, generation_id="", owner_id="")
+    _release(conn)
+
+
+@contextmanager
+def db_connection() -> Iterator[sqlite3.Connection]:
+  try:
+    conn = _pool.get_nowait()
+  except queue.Empty:
+    conn = _connect()
+  try:
+    yield conn
+    conn.commit()
+  except BaseException:
+    try:
+      conn.rollback()
+    except sqlite3.Error:
+      conn.close()
+      raise
+    _release(conn)
+    raise
+  _release(conn)
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+  # BEGIN IMMEDIATE takes the write lock up front, so a read-then-write
+  # sequence waits on busy_timeout instead of failing its lock upgrade.
+  if conn.in_transaction:
+    raise RuntimeError("write_transaction requires a connection with no open transaction")
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    yield conn
+  except BaseException:
+    conn.rollback()
+    raise
+  conn.commit()
+
+
+@contextmanager
+def _rebuilding_table(conn: sqlite3.Connection) -> Iterator[None]:
+  # foreign_keys can only be toggled outside a transaction; with it still on,
+  # dropping the renamed *_old table would cascade into dependent rows.
+  if conn.in_transaction:
+    conn.commit()
+  conn.execute("PRAGMA foreign_keys=OFF;")
+  try:
+    with write_transaction(conn):
+      yield
+  finally:
     conn.execute("PRAGMA foreign_keys=ON;")
+
+
+def _rebuild_users_table(conn: sqlite3.Connection, user_columns: set[str]) -> None:
+  with _rebuilding_table(conn):
+    conn.execute("ALTER TABLE users RENAME TO users_old")
+    should_copy_users = "email" in user_columns
+    if should_copy_users:
+      null_email_count = conn.execute(
+        "SELECT COUNT(*) FROM users_old WHERE email IS NULL OR email = ''"
+      ).fetchone()[0]
+      if null_email_count:
+        should_copy_users = False
     conn.execute(
       """
-      CREATE TABLE IF NOT EXISTS projects (
-        id TEXT PRIMARY KEY,
-        owner_id TEXT NOT NULL,
-        name TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL,
-        last_prompt TEXT,
-        last_slide_context TEXT,
-        slide_image_path TEXT,
-        UNIQUE(owner_id, name)
-      )
-      """
-    )
-    conn.execute(
-      """
-      CREATE TABLE IF NOT EXISTS generations (
-        id TEXT PRIMARY KEY,
-        project_id TEXT NOT NULL,
-        image_path TEXT NOT NULL,
-        description TEXT NOT NULL,
-        aspect_ratio TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
-      )
-      """
-    )
-    conn.execute(
-      """
-      CREATE TABLE IF NOT EXISTS users (
+      CREATE TABLE users (
         id TEXT PRIMARY KEY,
         email TEXT NOT NULL UNIQUE,
         username TEXT NOT NULL UNIQUE,
@@ -69,9 +398,30 @@ def init_db() -> None:
       )
       """
     )
+    email_expr = "email" if "email" in user_columns else "NULL AS email"
+    username_expr = "username" if "username" in user_columns else "NULL AS username"
+    password_expr = "password_hash" if "password_hash" in user_columns else "NULL AS password_hash"
+    name_expr = "name" if "name" in user_columns else "NULL AS name"
+    verified_expr = "email_verified" if "email_verified" in user_columns else "0 AS email_verified"
+    created_expr = "created_at" if "created_at" in user_columns else "'' AS created_at"
+    if should_copy_users:
+      conn.execute(
+        f"""
+        INSERT INTO users (id, email, username, password_hash, name, email_verified, created_at)
+        SELECT id, {email_expr}, {username_expr}, {password_expr}, {name_expr}, {verified_expr}, {created_expr}
+        FROM users_old
+        """
+      )
+    conn.execute("DROP TABLE users_old")
+
+    existing = conn.execute(
+      "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'password_reset_tokens'",
+    ).fetchone()
+    if existing:
+      conn.execute("DROP TABLE password_reset_tokens")
     conn.execute(
       """
-      CREATE TABLE IF NOT EXISTS password_reset_tokens (
+      CREATE TABLE password_reset_tokens (
         id TEXT PRIMARY KEY,
         user_id TEXT NOT NULL,
         token_hash TEXT NOT NULL UNIQUE,
@@ -82,9 +432,42 @@ def init_db() -> None:
       )
       """
     )
+
+    session_columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+    if session_columns:
+      conn.execute("ALTER TABLE sessions RENAME TO sessions_old")
+      conn.execute(
+        """
+        CREATE TABLE sessions (
+          id TEXT PRIMARY KEY,
+          user_id TEXT NOT NULL,
+          token_hash TEXT NOT NULL UNIQUE,
+          created_at TEXT NOT NULL,
+          expires_at TEXT NOT NULL,
+          FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+      )
+      if should_copy_users:
+        conn.execute(
+          """
+          INSERT INTO sessions (id, user_id, token_hash, created_at, expires_at)
+          SELECT id, user_id, token_hash, created_at, expires_at
+          FROM sessions_old
+          """
+        )
+      conn.execute("DROP TABLE sessions_old")
+
+
+def _rebuild_sessions_table(conn: sqlite3.Connection) -> None:
+  session_columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+  if not session_columns:
+    return
+  with _rebuilding_table(conn):
+    conn.execute("ALTER TABLE sessions RENAME TO sessions_old")
     conn.execute(
       """
-      CREATE TABLE IF NOT EXISTS sessions (
+      CREATE TABLE sessions (
         id TEXT PRIMARY KEY,
         user_id TEXT NOT NULL,
         token_hash TEXT NOT NULL UNIQUE,
@@ -96,9 +479,28 @@ def init_db() -> None:
     )
     conn.execute(
       """
-      CREATE TABLE IF NOT EXISTS payment_orders (
+      INSERT INTO sessions (id, user_id, token_hash, created_at, expires_at)
+      SELECT id, user_id, token_hash, created_at, expires_at
+      FROM sessions_old
+      """
+    )
+    conn.execute("DROP TABLE sessions_old")
+
+
+def _rebuild_payment_orders_table(
+  conn: sqlite3.Connection,
+  payment_columns: set[str],
+  *,
+  enforce_user_not_null: bool,
+) -> None:
+  with _rebuilding_table(conn):
+    conn.execute("ALTER TABLE payment_orders RENAME TO payment_orders_old")
+    user_id_column = "TEXT NOT NULL" if enforce_user_not_null else "TEXT"
+    conn.execute(
+      f"""
+      CREATE TABLE payment_orders (
         order_id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
+        user_id {user_id_column},
         idempotency_key TEXT,
         plan_id TEXT NOT NULL,
         gross_amount INTEGER NOT NULL,
@@ -119,285 +521,65 @@ def init_db() -> None:
       )
       """
     )
-    conn.execute(
-      """
-      CREATE TABLE IF NOT EXISTS payment_events (
-        id TEXT PRIMARY KEY,
-        order_id TEXT,
-        event_type TEXT NOT NULL,
-        payload_json TEXT NOT NULL,
-        received_at TEXT NOT NULL
-      )
-      """
-    )
-    conn.execute(
-      """
-      CREATE TABLE IF NOT EXISTS subscriptions (
-        user_id TEXT PRIMARY KEY,
-        plan_id TEXT NOT NULL,
-        status TEXT NOT NULL,
-        order_id TEXT,
-        started_at TEXT,
-        current_period_end TEXT,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-      )
-      """
-    )
-    conn.execute(
-      """
-      CREATE TABLE IF NOT EXISTS subscription_periods (
-        id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
-        order_id TEXT NOT NULL,
-        plan_id TEXT NOT NULL,
-        status TEXT NOT NULL,
-        period_start TEXT NOT NULL,
-        period_end TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-      )
-      """
-    )
-    _maybe_migrate(conn)
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_projects_owner_id ON projects(owner_id)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_project_id ON generations(project_id)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_created_at ON generations(created_at)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_reset_tokens_user_id ON password_reset_tokens(user_id)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_reset_tokens_expires_at ON password_reset_tokens(expires_at)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_payment_orders_status ON payment_orders(status)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_payment_orders_created_at ON payment_orders(created_at)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_payment_orders_user_id ON payment_orders(user_id)")
-    conn.execute(
-      """
-      CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_orders_idempotency
-      ON payment_orders(user_id, idempotency_key)
-      WHERE idempotency_key IS NOT NULL
-      """
-    )
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_payment_events_order_id ON payment_events(order_id)")
-    conn.execute(
-      "CREATE INDEX IF NOT EXISTS idx_payment_events_order_received ON payment_events(order_id, received_at)"
-    )
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_subscription_periods_user_id ON subscription_periods(user_id)")
-    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_subscription_periods_order_id ON subscription_periods(order_id)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_status ON subscriptions(status)")
-    conn.commit()
-  finally:
-    conn.close()
-
-
-@contextmanager
-def db_connection() -> Iterator[sqlite3.Connection]:
-  conn = sqlite3.connect(DB_PATH)
-  conn.row_factory = sqlite3.Row
-  conn.execute("PRAGMA busy_timeout=5000;")
-  conn.execute("PRAGMA foreign_keys=ON;")
-  try:
-    yield conn
-    conn.commit()
-  finally:
-    conn.close()
-
-
-def _rebuild_users_table(conn: sqlite3.Connection, user_columns: set[str]) -> None:
-  conn.execute("PRAGMA foreign_keys=OFF;")
-  conn.execute("ALTER TABLE users RENAME TO users_old")
-  should_copy_users = "email" in user_columns
-  if should_copy_users:
-    null_email_count = conn.execute(
-      "SELECT COUNT(*) FROM users_old WHERE email IS NULL OR email = ''"
-    ).fetchone()[0]
-    if null_email_count:
-      should_copy_users = False
-  conn.execute(
-    """
-    CREATE TABLE users (
-      id TEXT PRIMARY KEY,
-      email TEXT NOT NULL UNIQUE,
-      username TEXT NOT NULL UNIQUE,
-      password_hash TEXT NOT NULL,
-      name TEXT,
-      email_verified INTEGER NOT NULL DEFAULT 0,
-      created_at TEXT NOT NULL
-    )
-    """
-  )
-  email_expr = "email" if "email" in user_columns else "NULL AS email"
-  username_expr = "username" if "username" in user_columns else "NULL AS username"
-  password_expr = "password_hash" if "password_hash" in user_columns else "NULL AS password_hash"
-  name_expr = "name" if "name" in user_columns else "NULL AS name"
-  verified_expr = "email_verified" if "email_verified" in user_columns else "0 AS email_verified"
-  created_expr = "created_at" if "created_at" in user_columns else "'' AS created_at"
-  if should_copy_users:
+    select_exprs = [
+      column if column in payment_columns else f"NULL AS {column}"
+      for column in _PAYMENT_ORDER_COLUMNS
+    ]
     conn.execute(
       f"""
-      INSERT INTO users (id, email, username, password_hash, name, email_verified, created_at)
-      SELECT id, {email_expr}, {username_expr}, {password_expr}, {name_expr}, {verified_expr}, {created_expr}
-      FROM users_old
+      INSERT INTO payment_orders ({_PAYMENT_ORDER_COLUMN_LIST})
+      SELECT {", ".join(select_exprs)}
+      FROM payment_orders_old
       """
     )
-  conn.execute("DROP TABLE users_old")
+    conn.execute("DROP TABLE payment_orders_old")
 
-  existing = conn.execute(
-    "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'password_reset_tokens'",
-  ).fetchone()
-  if existing:
-    conn.execute("DROP TABLE password_reset_tokens")
-  conn.execute(
-    """
-    CREATE TABLE password_reset_tokens (
-      id TEXT PRIMARY KEY,
-      user_id TEXT NOT NULL,
-      token_hash TEXT NOT NULL UNIQUE,
-      created_at TEXT NOT NULL,
-      expires_at TEXT NOT NULL,
-      used_at TEXT,
-      FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )
-    """
-  )
 
-  session_columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
-  if session_columns:
-    conn.execute("ALTER TABLE sessions RENAME TO sessions_old")
-    conn.execute(
-      """
-      CREATE TABLE sessions (
-        id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
-        token_hash TEXT NOT NULL UNIQUE,
-        created_at TEXT NOT NULL,
-        expires_at TEXT NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-      )
-      """
-    )
-    if should_copy_users:
-      conn.execute(
-        """
-        INSERT INTO sessions (id, user_id, token_hash, created_at, expires_at)
-        SELECT id, user_id, token_hash, created_at, expires_at
-        FROM sessions_old
-        """
-      )
-    conn.execute("DROP TABLE sessions_old")
-
-  conn.execute("PRAGMA foreign_keys=ON;")
-
-
-def _rebuild_sessions_table(conn: sqlite3.Connection) -> None:
-  session_columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
-  if not session_columns:
-    return
-  conn.execute("PRAGMA foreign_keys=OFF;")
-  conn.execute("ALTER TABLE sessions RENAME TO sessions_old")
-  conn.execute(
-    """
-    CREATE TABLE sessions (
-      id TEXT PRIMARY KEY,
-      user_id TEXT NOT NULL,
-      token_hash TEXT NOT NULL UNIQUE,
-      created_at TEXT NOT NULL,
-      expires_at TEXT NOT NULL,
-      FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )
-    """
-  )
-  conn.execute(
-    """
-    INSERT INTO sessions (id, user_id, token_hash, created_at, expires_at)
-    SELECT id, user_id, token_hash, created_at, expires_at
-    FROM sessions_old
-    """
-  )
-  conn.execute("DROP TABLE sessions_old")
-  conn.execute("PRAGMA foreign_keys=ON;")
-
-
-def _rebuild_payment_orders_table(
+def _schema_snapshot(
   conn: sqlite3.Connection,
-  payment_columns: set[str],
-  *,
-  enforce_user_not_null: bool,
-) -> None:
-  conn.execute("PRAGMA foreign_keys=OFF;")
-  conn.execute("ALTER TABLE payment_orders RENAME TO payment_orders_old")
-  user_id_column = "TEXT NOT NULL" if enforce_user_not_null else "TEXT"
-  conn.execute(
-    f"""
-    CREATE TABLE payment_orders (
-      order_id TEXT PRIMARY KEY,
-      user_id {user_id_column},
-      idempotency_key TEXT,
-      plan_id TEXT NOT NULL,
-      gross_amount INTEGER NOT NULL,
-      currency TEXT NOT NULL,
-      customer_name TEXT NOT NULL,
-      customer_email TEXT NOT NULL,
-      customer_phone TEXT NOT NULL,
-      status TEXT NOT NULL,
-      snap_token TEXT,
-      transaction_status TEXT,
-      fraud_status TEXT,
-      status_code TEXT,
-      created_at TEXT NOT NULL,
-      updated_at TEXT NOT NULL,
-      paid_at TEXT,
-      last_notification_json TEXT,
-      FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    )
+) -> tuple[dict[str, dict[str, int]], dict[str, set[tuple[str, str]]]]:
+  columns: dict[str, dict[str, int]] = {}
+  foreign_keys: dict[str, set[tuple[str, str]]] = {}
+  rows = conn.execute(
     """
-  )
-  columns = [
-    "order_id",
-    "user_id",
-    "idempotency_key",
-    "plan_id",
-    "gross_amount",
-    "currency",
-    "customer_name",
-    "customer_email",
-    "customer_phone",
-    "status",
-    "snap_token",
-    "transaction_status",
-    "fraud_status",
-    "status_code",
-    "created_at",
-    "updated_at",
-    "paid_at",
-    "last_notification_json",
-  ]
-  select_exprs = [
-    column if column in payment_columns else f"NULL AS {column}"
-    for column in columns
-  ]
-  conn.execute(
-    f"""
-    INSERT INTO payment_orders ({", ".join(columns)})
-    SELECT {", ".join(select_exprs)}
-    FROM payment_orders_old
+    SELECT m.name, 'column', c.name, c."notnull"
+    FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS c
+    WHERE m.type = 'table'
+    UNION ALL
+    SELECT m.name, 'fk', f."table", f."from"
+    FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+    WHERE m.type = 'table'
     """
   )
-  conn.execute("DROP TABLE payment_orders_old")
-  conn.execute("PRAGMA foreign_keys=ON;")
+  for table, kind, first, second in rows:
+    if kind == "column":
+      columns.setdefault(table, {})[first] = second
+    else:
+      foreign_keys.setdefault(table, set()).add((first, second))
+  return columns, foreign_keys
 
 
 def _maybe_migrate(conn: sqlite3.Connection) -> None:
-  columns = {row[1] for row in conn.execute("PRAGMA table_info(projects)")}
+  if conn.execute("PRAGMA user_version").fetchone()[0] >= _SCHEMA_VERSION:
+    return
+  table_columns, table_fks = _schema_snapshot(conn)
+  columns = set(table_columns.get("projects", ()))
   if "owner_id" not in columns:
     conn.execute("ALTER TABLE projects ADD COLUMN owner_id TEXT NOT NULL DEFAULT 'local'")
     conn.execute("UPDATE projects SET owner_id = 'local' WHERE owner_id IS NULL")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_projects_owner_name ON projects(owner_id, name)")
   if "slide_image_path" not in columns:
     conn.execute("ALTER TABLE projects ADD COLUMN slide_image_path TEXT")
+  if "generation_count" not in columns:
+    conn.execute("ALTER TABLE projects ADD COLUMN generation_count INTEGER NOT NULL DEFAULT 0")
+    conn.execute(
+      """
+      UPDATE projects
+      SET generation_count = (SELECT COUNT(*) FROM generations WHERE generations.project_id = projects.id)
+      """
+    )
 
-  user_info = list(conn.execute("PRAGMA table_info(users)"))
-  user_columns = {row[1] for row in user_info}
+  user_columns = set(table_columns.get("users", ()))
   if user_columns:
     required_columns = {"id", "email", "username", "password_hash", "name", "email_verified", "created_at"}
     deprecated_columns = {"google_sub"}
@@ -408,8 +590,8 @@ def _maybe_migrate(conn: sqlite3.Connection) -> None:
     if requires_rebuild:
       _rebuild_users_table(conn, user_columns)
       user_columns = required_columns
-    fk_targets = {row[2] for row in conn.execute("PRAGMA foreign_key_list(sessions)")}
-    if "users_old" in fk_targets:
+      table_columns, table_fks = _schema_snapshot(conn)
+    if any(target == "users_old" for target, _ in table_fks.get("sessions", ())):
       _rebuild_sessions_table(conn)
     if "name" not in user_columns:
       conn.execute("ALTER TABLE users ADD COLUMN name TEXT")
@@ -424,12 +606,10 @@ def _maybe_migrate(conn: sqlite3.Connection) -> None:
     conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email)")
     conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)")
 
-  payment_info = list(conn.execute("PRAGMA table_info(payment_orders)"))
-  payment_columns = {row[1]: row for row in payment_info}
+  payment_columns = table_columns.get("payment_orders", {})
   if payment_columns:
-    payment_fks = list(conn.execute("PRAGMA foreign_key_list(payment_orders)"))
-    has_user_fk = any(row[2] == "users" and row[3] == "user_id" for row in payment_fks)
-    user_not_null = bool(payment_columns.get("user_id")) and payment_columns["user_id"][3] == 1
+    has_user_fk = ("users", "user_id") in table_fks.get("payment_orders", ())
+    user_not_null = payment_columns.get("user_id") == 1
     null_user_count = 0
     if "user_id" in payment_columns:
       null_user_count = conn.execute(
@@ -443,7 +623,7 @@ def _maybe_migrate(conn: sqlite3.Connection) -> None:
         set(payment_columns),
         enforce_user_not_null=enforce_user_not_null,
       )
-      payment_columns = {row[1]: row for row in conn.execute("PRAGMA table_info(payment_orders)")}
+      payment_columns = _schema_snapshot(conn)[0].get("payment_orders", {})
     if "user_id" not in payment_columns:
       conn.execute("ALTER TABLE payment_orders ADD COLUMN user_id TEXT")
     if "idempotency_key" not in payment_columns:
@@ -457,6 +637,7 @@ def _maybe_migrate(conn: sqlite3.Connection) -> None:
     WHERE idempotency_key IS NOT NULL
     """
   )
+  conn.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
 
 
 def get_or_create_project(
@@ -468,46 +649,87 @@ def get_or_create_project(
   prompt: str,
   slide_context: str,
 ) -> str:
-  existing = conn.execute(
-    "SELECT id FROM projects WHERE owner_id = ? AND name = ?",
-    (owner_id, name),
-  ).fetchone()
-  if existing:
-    conn.execute(
-      """
-      UPDATE projects
-      SET updated_at = ?, last_prompt = ?, last_slide_context = ?
-      WHERE id = ?
-      """,
-      (updated_at, prompt, slide_context, existing["id"]),
-    )
-    return str(existing["id"])
-
-  project_id = str(uuid4())
-  conn.execute(
+  row = conn.execute(
     """
     INSERT INTO projects (id, owner_id, name, created_at, updated_at, last_prompt, last_slide_context)
     VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(owner_id, name) DO UPDATE SET
+      updated_at = excluded.updated_at,
+      last_prompt = excluded.last_prompt,
+      last_slide_context = excluded.last_slide_context
+    RETURNING id
     """,
-    (project_id, owner_id, name, updated_at, updated_at, prompt, slide_context),
-  )
-  return project_id
+    (new_id(), owner_id, name, updated_at, updated_at, prompt, slide_context),
+  ).fetchone()
+  return str(row["id"])
+
+
+def _dir_fd(directory: Path) -> Optional[int]:
+  if not {os.open, os.unlink} <= os.supports_dir_fd:
+    return None
+  fd = _dir_fds.get(directory)
+  if fd is None:
+    opened = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    # Disk-IO threads can race here; keep whichever fd landed first.
+    fd = _dir_fds.setdefault(directory, opened)
+    if fd != opened:
+      os.close(opened)
+  return fd
+
+
+def _write_file(directory: Path, filename: str, data: bytes) -> None:
+  # Write to a temp file and rename over the target so readers never see a
+  # partial image; the pages are dropped from the page cache once flushed.
+  dir_fd = _dir_fd(directory)
+  tmp_name = f".{filename}.{secrets.token_hex(4)}.tmp"
+  tmp_target = tmp_name if dir_fd is not None else directory / tmp_name
+  target = filename if dir_fd is not None else directory / filename
+  fd = os.open(tmp_target, _WRITE_FLAGS, 0o644, dir_fd=dir_fd)
+  try:
+    view = memoryview(data)
+    while view:
+      view = view[os.write(fd, view):]
+    os.fsync(fd)
+    if _fadvise is not None:
+      _fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+  except BaseException:
+    os.close(fd)
+    os.unlink(tmp_target, dir_fd=dir_fd)
+    raise
+  os.close(fd)
+  os.replace(tmp_target, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
 
 
 def save_generated_image(image_bytes: bytes, image_id: Optional[str] = None) -> str:
   if not image_id:
-    image_id = str(uuid4())
-  relative_path = Path("images") / f"{image_id}.png"
-  full_path = DATA_DIR / relative_path
-  full_path.write_bytes(image_bytes)
-  return str(relative_path)
+    image_id = new_id()
+  filename = f"{image_id}.png"
+  _write_file(IMAGES_DIR, filename, image_bytes)
+  return str(Path("images") / filename)
 
 
 def save_slide_image(image_bytes: bytes, project_id: str) -> str:
-  relative_path = Path("slides") / f"{project_id}.png"
-  full_path = DATA_DIR / relative_path
-  full_path.write_bytes(image_bytes)
-  return str(relative_path)
+  filename = f"{project_id}.png"
+  _write_file(SLIDES_DIR, filename, image_bytes)
+  return str(Path("slides") / filename)
+
+
+async def save_generated_image_async(image_bytes: bytes, image_id: Optional[str] = None) -> str:
+  return await asyncio.get_running_loop().run_in_executor(
+    _IO_POOL,
+    save_generated_image,
+    image_bytes,
+    image_id,
+  )
+
+
+async def save_slide_image_async(image_bytes: bytes, project_id: str) -> str:
+  return await asyncio.get_running_loop().run_in_executor(
+    _IO_POOL,
+    save_slide_image,
+    image_bytes,
+    project_id,
+  )
 
 
 def insert_generation(
@@ -537,7 +759,7 @@ def get_user_by_username(conn: sqlite3.Connection, username: str) -> Optional[di
     """,
     (username,),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def get_user_by_email(conn: sqlite3.Connection, email: str) -> Optional[dict]:
@@ -548,7 +770,7 @@ def get_user_by_email(conn: sqlite3.Connection, email: str) -> Optional[dict]:
     """,
     (email,),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def create_user_with_password(
@@ -560,7 +782,7 @@ def create_user_with_password(
   name: str,
   created_at: str,
 ) -> str:
-  user_id = str(uuid4())
+  user_id = new_id()
   conn.execute(
     """
     INSERT INTO users (id, email, username, password_hash, name, email_verified, created_at)
@@ -583,12 +805,13 @@ def delete_user(conn: sqlite3.Connection, user_id: str) -> None:
     "DELETE FROM users WHERE id = ?",
     (user_id,),
   )
+  _forget_user_sessions(user_id)
 
 
 def create_session(conn: sqlite3.Connection, *, user_id: str, created_at: str, expires_at: str) -> str:
-  raw = secrets.token_urlsafe(32)
+  raw = _new_token()
   token_hash = _hash_token(raw)
-  session_id = str(uuid4())
+  session_id = new_id()
   conn.execute(
     """
     INSERT INTO sessions (id, user_id, token_hash, created_at, expires_at)
@@ -599,16 +822,37 @@ def create_session(conn: sqlite3.Connection, *, user_id: str, created_at: str, e
   return raw
 
 
+def _forget_user_sessions(user_id: str) -> None:
+  with _session_lock:
+    stale = [token_hash for token_hash, (cached_user, _, _) in _session_cache.items() if cached_user == user_id]
+    for token_hash in stale:
+      del _session_cache[token_hash]
+
+
 def get_user_id_for_token(conn: sqlite3.Connection, token: str, now: str) -> Optional[str]:
+  if len(token) != _TOKEN_LENGTH:
+    return None
   token_hash = _hash_token(token)
+  cached = _session_cache.get(token_hash)
+  if cached and cached[1] > now and time.monotonic() - cached[2] < _SESSION_CACHE_TTL:
+    return cached[0]
   row = conn.execute(
     """
-    SELECT user_id FROM sessions
+    SELECT user_id, expires_at FROM sessions
     WHERE token_hash = ? AND expires_at > ?
     """,
     (token_hash, now),
   ).fetchone()
-  return str(row["user_id"]) if row else None
+  if not row:
+    with _session_lock:
+      _session_cache.pop(token_hash, None)
+    return None
+  user_id = str(row["user_id"])
+  with _session_lock:
+    if len(_session_cache) >= _SESSION_CACHE_SIZE:
+      del _session_cache[next(iter(_session_cache))]
+    _session_cache[token_hash] = (user_id, str(row["expires_at"]), time.monotonic())
+  return user_id
 
 
 def create_password_reset_token(
@@ -618,9 +862,9 @@ def create_password_reset_token(
   created_at: str,
   expires_at: str,
 ) -> str:
-  raw = secrets.token_urlsafe(32)
+  raw = _new_token()
   token_hash = _hash_token(raw)
-  token_id = str(uuid4())
+  token_id = new_id()
   conn.execute(
     """
     INSERT INTO password_reset_tokens (id, user_id, token_hash, created_at, expires_at)
@@ -632,6 +876,8 @@ def create_password_reset_token(
 
 
 def consume_password_reset_token(conn: sqlite3.Connection, *, token: str, now: str) -> Optional[str]:
+  if len(token) != _TOKEN_LENGTH:
+    return None
   token_hash = _hash_token(token)
   row = conn.execute(
     """
@@ -692,23 +938,14 @@ def update_project_slide_image(
 def list_projects(conn: sqlite3.Connection, owner_id: str) -> list[dict]:
   rows = conn.execute(
     """
-    SELECT
-      projects.id,
-      projects.name,
-      projects.created_at,
-      projects.updated_at,
-      projects.last_prompt,
-      projects.last_slide_context,
-      COUNT(generations.id) AS generation_count
+    SELECT id, name, created_at, updated_at, last_prompt, last_slide_context, generation_count
     FROM projects
-    LEFT JOIN generations ON generations.project_id = projects.id
-    WHERE projects.owner_id = ?
-    GROUP BY projects.id
-    ORDER BY projects.updated_at DESC
+    WHERE owner_id = ?
+    ORDER BY updated_at DESC
     """,
     (owner_id,),
   ).fetchall()
-  return [dict(row) for row in rows]
+  return rows
 
 
 def get_project(conn: sqlite3.Connection, owner_id: str, project_id: str) -> Optional[dict]:
@@ -720,7 +957,7 @@ def get_project(conn: sqlite3.Connection, owner_id: str, project_id: str) -> Opt
     """,
     (owner_id, project_id),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def get_project_slide_image_path(
@@ -729,7 +966,7 @@ def get_project_slide_image_path(
   owner_id: str,
   project_id: str,
 ) -> Optional[str]:
-  row = conn.execute(
+  row = _tuple_cursor(conn).execute(
     """
     SELECT slide_image_path
     FROM projects
@@ -739,7 +976,7 @@ def get_project_slide_image_path(
   ).fetchone()
   if not row:
     return None
-  return str(row["slide_image_path"]) if row["slide_image_path"] else None
+  return str(row[0]) if row[0] else None
 
 
 def list_generations(conn: sqlite3.Connection, project_id: str) -> list[dict]:
@@ -748,15 +985,15 @@ def list_generations(conn: sqlite3.Connection, project_id: str) -> list[dict]:
     SELECT id, image_path, description, aspect_ratio, created_at
     FROM generations
     WHERE project_id = ?
-    ORDER BY created_at DESC
+    ORDER BY created_at DESC, id DESC
     """,
     (project_id,),
   ).fetchall()
-  return [dict(row) for row in rows]
+  return rows
 
 
 def list_generation_image_paths(conn: sqlite3.Connection, project_id: str) -> list[str]:
-  rows = conn.execute(
+  rows = _tuple_cursor(conn).execute(
     """
     SELECT image_path
     FROM generations
@@ -764,15 +1001,15 @@ def list_generation_image_paths(conn: sqlite3.Connection, project_id: str) -> li
     """,
     (project_id,),
   ).fetchall()
-  return [str(row["image_path"]) for row in rows]
+  return [str(row[0]) for row in rows]
 
 
 def get_generation_image_path(conn: sqlite3.Connection, generation_id: str) -> Optional[str]:
-  row = conn.execute(
+  row = _tuple_cursor(conn).execute(
     "SELECT image_path FROM generations WHERE id = ?",
     (generation_id,),
   ).fetchone()
-  return str(row["image_path"]) if row else None
+  return str(row[0]) if row else None
 
 
 def get_generation_image_path_for_user(
@@ -781,7 +1018,7 @@ def get_generation_image_path_for_user(
   generation_id: str,
   owner_id: str,
 ) -> Optional[str]:
-  row = conn.execute(
+  row = _tuple_cursor(conn).execute(
     """
     SELECT generations.image_path
     FROM generations
@@ -790,7 +1027,7 @@ def get_generation_image_path_for_user(
     """,
     (generation_id, owner_id),
   ).fetchone()
-  return str(row["image_path"]) if row else None
+  return str(row[0]) if row else None
 
 
 def delete_project(conn: sqlite3.Connection, owner_id: str, project_id: str) -> bool:
@@ -829,80 +1066,48 @@ def create_payment_order(
   if not user_id:
     raise ValueError("user_id required")
   conn.execute(
-    """
-    INSERT INTO payment_orders (
-      order_id,
-      user_id,
-      idempotency_key,
-      plan_id,
-      gross_amount,
-      currency,
-      customer_name,
-      customer_email,
-      customer_phone,
-      status,
-      snap_token,
-      transaction_status,
-      fraud_status,
-      status_code,
-      created_at,
-      updated_at,
-      paid_at,
-      last_notification_json
-    )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-    (
-      order_id,
-      user_id,
-      idempotency_key,
-      plan_id,
-      gross_amount,
-      currency,
-      customer_name,
-      customer_email,
-      customer_phone,
-      status,
-      snap_token,
-      transaction_status,
-      fraud_status,
-      status_code,
-      created_at,
-      updated_at,
-      paid_at,
-      last_notification_json,
-    ),
+    _PAYMENT_ORDER_INSERT_SQL,
+    {
+      "order_id": order_id,
+      "user_id": user_id,
+      "idempotency_key": idempotency_key,
+      "plan_id": plan_id,
+      "gross_amount": gross_amount,
+      "currency": currency,
+      "customer_name": customer_name,
+      "customer_email": customer_email,
+      "customer_phone": customer_phone,
+      "status": status,
+      "snap_token": snap_token,
+      "transaction_status": transaction_status,
+      "fraud_status": fraud_status,
+      "status_code": status_code,
+      "created_at": created_at,
+      "updated_at": updated_at,
+      "paid_at": paid_at,
+      "last_notification_json": last_notification_json,
+    },
   )
 
 
 def get_payment_order(conn: sqlite3.Connection, order_id: str) -> Optional[dict]:
+  row = conn.execute(
+    _PAYMENT_ORDER_SELECT_SQL + " WHERE order_id = ?",
+    (order_id,),
+  ).fetchone()
+  return row
+
+
+def get_payment_order_summary(conn: sqlite3.Connection, order_id: str) -> Optional[dict]:
   row = conn.execute(
     """
-    SELECT
-      order_id,
-      user_id,
-      idempotency_key,
-      plan_id,
-      gross_amount,
-      currency,
-      customer_name,
-      customer_email,
-      customer_phone,
-      status,
-      snap_token,
-      transaction_status,
-      fraud_status,
-      status_code,
-      created_at,
-      updated_at,
-      paid_at,
-      last_notification_json
+    SELECT order_id, user_id, plan_id, gross_amount, status, snap_token, updated_at, paid_at
     FROM payment_orders
     WHERE order_id = ?
     """,
     (order_id,),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def get_payment_order_by_idempotency_key(
@@ -912,32 +1117,10 @@ def get_payment_order_by_idempotency_key(
   idempotency_key: str,
 ) -> Optional[dict]:
   row = conn.execute(
-    """
-    SELECT
-      order_id,
-      user_id,
-      idempotency_key,
-      plan_id,
-      gross_amount,
-      currency,
-      customer_name,
-      customer_email,
-      customer_phone,
-      status,
-      snap_token,
-      transaction_status,
-      fraud_status,
-      status_code,
-      created_at,
-      updated_at,
-      paid_at,
-      last_notification_json
-    FROM payment_orders
-    WHERE user_id = ? AND idempotency_key = ?
-    """,
+    _PAYMENT_ORDER_SELECT_SQL + " WHERE user_id = ? AND idempotency_key = ?",
     (user_id, idempotency_key),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def update_payment_order_token(
@@ -987,6 +1170,16 @@ def update_payment_order_processing_status(
   return cursor.rowcount > 0
 
 
+@lru_cache(maxsize=8)
+def _claim_sql(status_count: int) -> str:
+  placeholders = ", ".join("?" * status_count)
+  return f"""
+    UPDATE payment_orders
+    SET status = ?, updated_at = ?
+    WHERE order_id = ? AND status IN ({placeholders}) AND snap_token IS NULL
+    """
+
+
 def claim_payment_order_for_token(
   conn: sqlite3.Connection,
   *,
@@ -996,13 +1189,8 @@ def claim_payment_order_for_token(
 ) -> bool:
   if not allowed_statuses:
     return False
-  placeholders = ", ".join("?" for _ in allowed_statuses)
   cursor = conn.execute(
-    f"""
-    UPDATE payment_orders
-    SET status = ?, updated_at = ?
-    WHERE order_id = ? AND status IN ({placeholders}) AND snap_token IS NULL
-    """,
+    _claim_sql(len(allowed_statuses)),
     ("CREATING", updated_at, order_id, *allowed_statuses),
   )
   return cursor.rowcount > 0
@@ -1071,6 +1259,25 @@ def insert_payment_event(
   )
 
 
+def insert_payment_events(
+  conn: sqlite3.Connection,
+  events: list[tuple[str, Optional[str], str, str, str]],
+) -> None:
+  conn.executemany(
+    """
+    INSERT INTO payment_events (
+      id,
+      order_id,
+      event_type,
+      payload_json,
+      received_at
+    )
+    VALUES (?, ?, ?, ?, ?)
+    """,
+    events,
+  )
+
+
 def get_latest_payment_event(
   conn: sqlite3.Connection,
   *,
@@ -1092,7 +1299,7 @@ def get_latest_payment_event(
     """,
     (order_id, event_type),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def create_subscription_period(
@@ -1159,7 +1366,7 @@ def get_subscription_period_by_order_id(
     """,
     (order_id,),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def update_subscription_period_status(
@@ -1180,14 +1387,16 @@ def update_subscription_period_status(
   return cursor.rowcount > 0
 
 
-def list_subscription_periods_for_user(
+def get_subscription_period_context(
   conn: sqlite3.Connection,
   *,
+  order_id: str,
   user_id: str,
-) -> list[dict]:
+) -> tuple[Optional[dict], Optional[dict]]:
   rows = conn.execute(
     """
     SELECT
+      'order' AS kind,
       id,
       user_id,
       order_id,
@@ -1198,39 +1407,53 @@ def list_subscription_periods_for_user(
       created_at,
       updated_at
     FROM subscription_periods
-    WHERE user_id = ?
-    ORDER BY period_end DESC, created_at DESC
+    WHERE order_id = ?
+    UNION ALL
+    SELECT * FROM (
+      SELECT
+        'latest_active' AS kind,
+        id,
+        user_id,
+        order_id,
+        plan_id,
+        status,
+        period_start,
+        period_end,
+        created_at,
+        updated_at
+      FROM subscription_periods
+      WHERE user_id = ? AND status = 'active'
+      ORDER BY period_end DESC
+      LIMIT 1
+    )
     """,
-    (user_id,),
+    (order_id, user_id),
   ).fetchall()
-  return [dict(row) for row in rows]
+  order_period = None
+  latest_active = None
+  for row in rows:
+    if row.pop("kind") == "order":
+      order_period = row
+    else:
+      latest_active = row
+  return order_period, latest_active
 
 
-def get_latest_active_subscription_period(
+def iter_subscription_periods_for_user(
   conn: sqlite3.Connection,
   *,
   user_id: str,
-) -> Optional[dict]:
-  row = conn.execute(
+) -> Iterator[dict]:
+  # Streamed straight off the cursor; callers that need a list wrap it.
+  yield from conn.execute(
     """
-    SELECT
-      id,
-      user_id,
-      order_id,
-      plan_id,
-      status,
-      period_start,
-      period_end,
-      created_at,
-      updated_at
+    SELECT order_id, plan_id, status, period_start, period_end, created_at
     FROM subscription_periods
-    WHERE user_id = ? AND status = 'active'
-    ORDER BY period_end DESC
-    LIMIT 1
+    WHERE user_id = ?
+    ORDER BY period_end DESC, created_at DESC
     """,
     (user_id,),
-  ).fetchone()
-  return dict(row) if row else None
+  )
 
 
 def get_subscription(conn: sqlite3.Connection, user_id: str) -> Optional[dict]:
@@ -1250,7 +1473,7 @@ def get_subscription(conn: sqlite3.Connection, user_id: str) -> Optional[dict]:
     """,
     (user_id,),
   ).fetchone()
-  return dict(row) if row else None
+  return row
 
 
 def upsert_subscription(
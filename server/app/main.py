@@ -1,24 +1,33 @@
-import base64
+import asyncio
 import hashlib
-import json
+import hmac
+import os
 from datetime import datetime, timedelta
 from time import perf_counter, time
 from uuid import uuid4
 
 import logging
 import sqlite3
-import requests
-from collections import defaultdict, deque
-from typing import Optional
-
-from fastapi import APIRouter, FastAPI, HTTPException, Request
+import threading
+import httpx
+import orjson
+import pybase64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from fastapi import APIRouter, BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 
-from .core.auth import hash_password, verify_password
+from .core.auth import hash_password_async, verify_password_async
 from .core.config import get_settings
 from .core.db import (
   DATA_DIR,
+  close_pool,
   create_user_with_password,
   create_session,
   create_password_reset_token,
@@ -30,7 +39,6 @@ from .core.db import (
   get_user_by_username,
   get_latest_payment_event,
   get_payment_order_by_idempotency_key,
-  get_latest_active_subscription_period,
   get_or_create_project,
   get_project,
   get_project_slide_image_path,
@@ -39,18 +47,21 @@ from .core.db import (
   insert_generation,
   list_generation_image_paths,
   list_generations,
-  list_subscription_periods_for_user,
+  iter_subscription_periods_for_user,
   list_projects,
+  new_id,
   delete_project,
   consume_password_reset_token,
   update_user_password,
   update_project_name,
-  save_generated_image,
-  save_slide_image,
+  save_generated_image_async,
+  save_slide_image_async,
   update_project_slide_image,
   create_payment_order,
   get_payment_order,
+  get_payment_order_summary,
   get_subscription_period_by_order_id,
+  get_subscription_period_context,
   update_payment_order_processing_status,
   update_payment_order_status,
   update_payment_order_token,
@@ -58,6 +69,9 @@ from .core.db import (
   get_subscription,
   upsert_subscription,
   insert_payment_event,
+  insert_payment_events,
+  write_transaction,
+  warm_pool,
 )
 from .schemas import (
   GenerateRequest,
@@ -71,19 +85,19 @@ from .schemas import (
 from .plans import get_plan_catalog
 from .services.email_client import send_email
 from .services.genai_client import genai_client
-from .services.rembg_client import remove_background
+from .services.rembg_client import remove_background, warm_up_background_removal
 
 
-def _allowed_origins() -> list[str]:
-  settings = get_settings()
-  origins = [origin.strip() for origin in settings.cors_allowed_origins.split(",") if origin.strip()]
-  return origins or ["http://localhost:3000"]
+class _ImageFileResponse(FileResponse):
+  # uvicorn has no zero-copy send extension, so stream PNGs in larger reads
+  # than Starlette's 64 KiB default to cut per-chunk overhead.
+  chunk_size = 1024 * 1024
 
 
-def _allowed_origin_regex(origins: list[str]) -> str | None:
+def _allowed_origin_regex(origins: tuple[str, ...]) -> str | None:
   for origin in origins:
     if origin.startswith("chrome-extension://"):
-      return r"^chrome-extension://.*$"
+      return r"^chrome-extension://[a-p]{32}\Z"
   return None
 
 
@@ -91,50 +105,97 @@ app = FastAPI(
   title="ODIN Workspace API",
   version="0.1.0",
   description="Service that orchestrates LLM + image generation for the ODIN workspace.",
+  default_response_class=ORJSONResponse,
 )
 router = APIRouter(prefix="/api")
 
 logger = logging.getLogger("odin")
 logger.setLevel(logging.INFO)
 
-_auth_requests: dict[tuple[str, str], deque[float]] = defaultdict(deque)
+_ERROR_BODY_PREVIEW_BYTES = 512
+_background_tasks: set[asyncio.Task] = set()
+_reconciling_orders: set[str] = set()
+
+_AUTH_RATE_WINDOW_SECONDS = 60.0
+
+
+@dataclass(slots=True)
+class _RateWindow:
+  start: float
+  previous: int = 0
+  current: int = 0
+
+
+_AUTH_RATE_MAX_KEYS = 100_000
+_auth_requests: OrderedDict[tuple[str, str], _RateWindow] = OrderedDict()
+
+_midtrans_client = httpx.AsyncClient(
+  timeout=20,
+  limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+)
+
+# Image generation is network-bound and rembg/OpenCV release the GIL, so a
+# request's variants render side by side instead of one after another.
+_variant_pool = ThreadPoolExecutor(
+  max_workers=min(4, os.cpu_count() or 1),
+  thread_name_prefix="variant",
+)
 
 
 def _rate_limit_auth(request: Request, action: str) -> None:
   settings = get_settings()
   limit = settings.auth_rate_limit_per_minute
-  window_seconds = 60.0
   client_ip = request.client.host if request.client else "unknown"
   key = (client_ip, action)
   now = time()
-  window = _auth_requests[key]
-  while window and window[0] <= now - window_seconds:
-    window.popleft()
-  if len(window) >= limit:
+  window = _auth_requests.get(key)
+  if window is None:
+    window = _auth_requests[key] = _RateWindow(start=now)
+    if len(_auth_requests) > _AUTH_RATE_MAX_KEYS:
+      _auth_requests.popitem(last=False)
+  else:
+    _auth_requests.move_to_end(key)
+
+  # Sliding-window counter: the previous fixed window's count is weighted by
+  # how much of it still overlaps the trailing minute.
+  elapsed = now - window.start
+  if elapsed >= _AUTH_RATE_WINDOW_SECONDS:
+    rolled = int(elapsed // _AUTH_RATE_WINDOW_SECONDS)
+    window.previous = window.current if rolled == 1 else 0
+    window.current = 0
+    window.start += rolled * _AUTH_RATE_WINDOW_SECONDS
+    elapsed -= rolled * _AUTH_RATE_WINDOW_SECONDS
+  estimated = window.previous * (1 - elapsed / _AUTH_RATE_WINDOW_SECONDS) + window.current
+  if estimated >= limit:
     logger.warning("Rate limit hit for %s from %s", action, client_ip)
     raise HTTPException(status_code=429, detail="Too many requests. Please try again soon.")
-  window.append(now)
+  window.current += 1
 
 
 def _sse_event(event: str, payload: dict) -> bytes:
-  data = json.dumps(payload, default=str)
-  return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+  return b"event: %b\ndata: %b\n\n" % (event.encode("ascii"), orjson.dumps(payload, default=str))
+
+
+def _iso_now(moment: Optional[datetime] = None) -> str:
+  return f"{(moment or datetime.utcnow()).isoformat()}Z"
+
+
+def _anonymous_generate_allowed(request: Request) -> bool:
+  return get_settings().allow_unauthenticated_generate and request.url.path.endswith("/generate")
 
 
 def _require_user_id(request: Request) -> str:
   auth_header = request.headers.get("Authorization", "")
   if not auth_header.startswith("Bearer "):
-    settings = get_settings()
-    if settings.allow_unauthenticated_generate and request.url.path.endswith("/generate"):
+    if _anonymous_generate_allowed(request):
       return "anonymous"
     raise HTTPException(status_code=401, detail="Authorization required.")
   token = auth_header.replace("Bearer ", "").strip()
-  now = datetime.utcnow().isoformat() + "Z"
+  now = _iso_now()
   with db_connection() as conn:
     user_id = get_user_id_for_token(conn, token, now)
   if not user_id:
-    settings = get_settings()
-    if settings.allow_unauthenticated_generate and request.url.path.endswith("/generate"):
+    if _anonymous_generate_allowed(request):
       return "anonymous"
     raise HTTPException(status_code=401, detail="Invalid or expired session.")
   return user_id
@@ -146,7 +207,10 @@ def _send_welcome_email(email: str, username: str) -> None:
     "We're excited to have you on board. Your workspace is ready.\n"
     "If you did not create this account, you can ignore this email."
   )
-  send_email(email, "Welcome to ODIN", body)
+  try:
+    send_email(email, "Welcome to ODIN", body)
+  except Exception as exc:
+    logger.warning("Failed to send welcome email: %s", exc)
 
 
 def _send_reset_email(email: str, token: str) -> None:
@@ -158,7 +222,10 @@ def _send_reset_email(email: str, token: str) -> None:
     f"{reset_url}\n\n"
     "If you did not request a reset, you can ignore this email."
   )
-  send_email(email, "Reset your ODIN password", body)
+  try:
+    send_email(email, "Reset your ODIN password", body)
+  except Exception:
+    logger.exception("Failed to send reset email")
 
 
 def _normalize_email(email: str) -> str:
@@ -204,41 +271,115 @@ def _midtrans_is_production(settings) -> bool:
   return settings.midtrans_is_production or env == "production"
 
 
-def _midtrans_snap_base_url(settings) -> str:
-  if _midtrans_is_production(settings):
+@lru_cache(maxsize=1)
+def _midtrans_snap_base_url() -> str:
+  if _midtrans_is_production(get_settings()):
     return "https://app.midtrans.com"
   return "https://app.sandbox.midtrans.com"
 
 
-def _midtrans_api_base_url(settings) -> str:
-  if _midtrans_is_production(settings):
+@lru_cache(maxsize=1)
+def _midtrans_api_base_url() -> str:
+  if _midtrans_is_production(get_settings()):
     return "https://api.midtrans.com"
   return "https://api.sandbox.midtrans.com"
 
 
+@lru_cache(maxsize=1)
 def _midtrans_auth_header(server_key: str) -> str:
   raw = f"{server_key}:".encode("ascii")
-  return base64.b64encode(raw).decode("ascii")
+  return f"Basic {pybase64.b64encode(raw).decode('ascii')}"
 
 
-def _fetch_midtrans_status(settings, order_id: str) -> tuple[str, Optional[dict]]:
-  url = f"{_midtrans_api_base_url(settings)}/v2/{order_id}/status"
+def _body_preview(response: httpx.Response) -> str:
+  # Edge errors can come back as large HTML pages; only the head is useful.
+  return response.content[:_ERROR_BODY_PREVIEW_BYTES].decode("utf-8", "replace")
+
+
+async def _fetch_midtrans_status(settings, order_id: str) -> tuple[str, Optional[dict]]:
+  url = f"{_midtrans_api_base_url()}/v2/{order_id}/status"
   headers = {
     "Accept": "application/json",
-    "Authorization": f"Basic {_midtrans_auth_header(settings.midtrans_server_key)}",
+    "Authorization": _midtrans_auth_header(settings.midtrans_server_key),
   }
   try:
-    response = requests.get(url, headers=headers, timeout=20)
-  except requests.RequestException:
+    response = await _midtrans_client.get(url, headers=headers)
+  except httpx.HTTPError:
     return ("error", None)
   if response.status_code == 404:
     return ("not_found", None)
   if response.status_code != 200:
-    return ("error", {"status_code": response.status_code, "body": response.text})
+    return ("error", {"status_code": response.status_code, "body": _body_preview(response)})
   try:
-    return ("ok", response.json())
+    return ("ok", orjson.loads(response.content))
   except ValueError:
-    return ("error", {"status_code": response.status_code, "body": response.text})
+    return ("error", {"status_code": response.status_code, "body": _body_preview(response)})
+
+
+async def _reconcile_stale_order(settings, order_id: str, existing: Optional[dict]) -> None:
+  # An order stuck in CREATING/PENDING past the processing timeout is checked
+  # against Midtrans here, so the retrying request can answer immediately.
+  try:
+    status_state, status_payload = await _fetch_midtrans_status(settings, order_id)
+    now = _iso_now()
+    if status_state == "ok" and status_payload:
+      transaction_status = status_payload.get("transaction_status")
+      fraud_status = status_payload.get("fraud_status")
+      status_code = status_payload.get("status_code")
+      internal_status = _map_midtrans_status(transaction_status, fraud_status)
+      notification_json = _payload_json(status_payload)
+      paid_at = existing.get("paid_at") if existing else None
+      if internal_status == "PAID" and not paid_at:
+        paid_at = now
+      with db_connection() as conn:
+        insert_payment_event(
+          conn,
+          event_id=new_id(),
+          order_id=order_id,
+          event_type="status_check",
+          payload_json=notification_json,
+          received_at=now,
+        )
+        update_payment_order_status(
+          conn,
+          order_id=order_id,
+          status=internal_status,
+          transaction_status=transaction_status,
+          fraud_status=fraud_status,
+          status_code=str(status_code) if status_code is not None else None,
+          last_notification_json=notification_json,
+          paid_at=paid_at,
+          updated_at=now,
+        )
+    elif status_state == "not_found":
+      with db_connection() as conn:
+        update_payment_order_processing_status(
+          conn,
+          order_id=order_id,
+          status="FAILED",
+          updated_at=now,
+        )
+  except Exception:
+    logger.exception("Failed to reconcile payment order %s", order_id)
+  finally:
+    _reconciling_orders.discard(order_id)
+
+
+def _order_conflict_detail(order: Optional[dict]) -> str:
+  # Retries on an order we cannot create a token for get the most settled
+  # answer the DB already has, not a blanket "processing".
+  status = order.get("status") if order else None
+  if status in ("PAID", "REFUNDED"):
+    return "Payment already completed."
+  if status == "FAILED":
+    return "Payment sebelumnya gagal diproses. Silakan coba lagi."
+  if order and order.get("transaction_status"):
+    return "Payment sudah dibuat. Silakan cek status pembayaran."
+  return "Payment sedang diproses. Coba lagi sebentar."
+
+
+def _payload_json(value: dict) -> str:
+  return orjson.dumps(value).decode("utf-8")
 
 
 def _midtrans_signature(
@@ -252,30 +393,38 @@ def _midtrans_signature(
   return hashlib.sha512(raw).hexdigest()
 
 
+_MIDTRANS_PAYMENT_STATUSES = {
+  "capture": "PAID",
+  "settlement": "PAID",
+  "pending": "PENDING",
+  "authorize": "PENDING",
+  "deny": "FAILED",
+  "cancel": "FAILED",
+  "expire": "FAILED",
+  "refund": "REFUNDED",
+  "partial_refund": "REFUNDED",
+  "chargeback": "REFUNDED",
+  "partial_chargeback": "REFUNDED",
+}
+
+_SUBSCRIPTION_STATUSES = {
+  "PAID": "active",
+  "FAILED": "canceled",
+  "REFUNDED": "canceled",
+}
+
+
 def _map_midtrans_status(transaction_status: str | None, fraud_status: str | None) -> str:
   if not transaction_status:
     return "UNKNOWN"
-  if transaction_status in ("capture", "settlement"):
-    if fraud_status == "challenge":
-      return "PENDING"
-    return "PAID"
-  if transaction_status in ("pending", "authorize"):
+  status = _MIDTRANS_PAYMENT_STATUSES.get(transaction_status, "UNKNOWN")
+  if status == "PAID" and fraud_status == "challenge":
     return "PENDING"
-  if transaction_status in ("deny", "cancel", "expire"):
-    return "FAILED"
-  if transaction_status in ("refund", "partial_refund", "chargeback", "partial_chargeback"):
-    return "REFUNDED"
-  return "UNKNOWN"
+  return status
 
 
 def _map_subscription_status(payment_status: str) -> str:
-  if payment_status == "PAID":
-    return "active"
-  if payment_status == "PENDING":
-    return "pending"
-  if payment_status in ("FAILED", "REFUNDED"):
-    return "canceled"
-  return "pending"
+  return _SUBSCRIPTION_STATUSES.get(payment_status, "pending")
 
 
 def _parse_iso_datetime(value: str | None) -> datetime | None:
@@ -295,31 +444,31 @@ def _next_billing_period(current_period_end: str | None, now: datetime) -> tuple
     period_start = now
   period_end = period_start + timedelta(days=30)
   return (
-    period_start.isoformat() + "Z",
-    period_end.isoformat() + "Z",
+    _iso_now(period_start),
+    _iso_now(period_end),
   )
 
 
-def _select_subscription_snapshot(periods: list[dict], now: datetime) -> Optional[dict]:
-  def period_end_dt(period: dict) -> datetime:
-    parsed = _parse_iso_datetime(period.get("period_end"))
-    return parsed if parsed else datetime.min
+def _select_subscription_snapshot(periods: Iterable[dict], now: datetime) -> Optional[dict]:
+  # Periods are ranked by (period_end, created_at); unparsable ends sort first.
+  selected = latest = None
+  selected_key = latest_key = None
+  for period in periods:
+    key = (_parse_iso_datetime(period.get("period_end")) or datetime.min, period.get("created_at") or "")
+    if latest is None or key > latest_key:
+      latest, latest_key = period, key
+    if period.get("status") == "active" and key[0] > now and (selected is None or key > selected_key):
+      selected, selected_key = period, key
 
-  active_candidates = [
-    period
-    for period in periods
-    if period.get("status") == "active" and period_end_dt(period) > now
-  ]
-  if active_candidates:
-    selected = max(active_candidates, key=period_end_dt)
+  if selected is not None:
     status = "active"
-  else:
-    if not periods:
-      return None
-    selected = max(periods, key=period_end_dt)
+  elif latest is not None:
+    selected, selected_key = latest, latest_key
     status = "canceled"
+  else:
+    return None
 
-  selected_end = period_end_dt(selected)
+  selected_end = selected_key[0]
   if selected_end == datetime.min:
     current_period_end = None
   elif status == "active":
@@ -332,16 +481,18 @@ def _select_subscription_snapshot(periods: list[dict], now: datetime) -> Optiona
     "plan_id": selected.get("plan_id") or "unknown",
     "order_id": selected.get("order_id"),
     "started_at": selected.get("period_start"),
-    "current_period_end": current_period_end.isoformat() + "Z" if current_period_end else None,
+    "current_period_end": _iso_now(current_period_end) if current_period_end else None,
   }
 
 
 def _refresh_subscription_snapshot(conn, user_id: str, now: datetime) -> None:
-  periods = list_subscription_periods_for_user(conn, user_id=user_id)
-  snapshot = _select_subscription_snapshot(periods, now)
+  snapshot = _select_subscription_snapshot(
+    iter_subscription_periods_for_user(conn, user_id=user_id),
+    now,
+  )
   if not snapshot:
     return
-  now_iso = now.isoformat() + "Z"
+  now_iso = _iso_now(now)
   upsert_subscription(
     conn,
     user_id=user_id,
@@ -355,23 +506,65 @@ def _refresh_subscription_snapshot(conn, user_id: str, now: datetime) -> None:
   )
 
 
+def _render_variant(
+  prompt: str,
+  aspect_ratio: str,
+  idx: int,
+  abandoned: threading.Event,
+) -> Optional[tuple[int, bytes, str, float, float]]:
+  # The stream sets `abandoned` once nobody will read this variant; skip the
+  # paid image call and rembg rather than render into the void.
+  if abandoned.is_set():
+    return None
+  image_start = perf_counter()
+  try:
+    semi_images = genai_client.generate_images(
+      prompt=prompt,
+      aspect_ratio=aspect_ratio,
+      count=1,
+    )
+    raw_image = semi_images[0]
+  except Exception:
+    logger.exception("Image generation failed")
+    raise
+  if abandoned.is_set():
+    return None
+
+  rembg_start = perf_counter()
+  try:
+    transparent = remove_background(raw_image)
+  except Exception:
+    logger.exception("Background removal failed")
+    raise
+  rembg_end = perf_counter()
+  return (
+    idx,
+    transparent,
+    pybase64.b64encode(transparent).decode("ascii"),
+    rembg_start - image_start,
+    rembg_end - rembg_start,
+  )
+
+
 def _decode_image_data(data_url: str) -> bytes:
   if not data_url:
     raise ValueError("Slide image missing.")
+  b64data = data_url
   if data_url.startswith("data:"):
-    _, b64data = data_url.split(",", 1)
-  else:
-    b64data = data_url
+    comma = data_url.find(",")
+    if comma < 0:
+      raise ValueError("Invalid slide image data.")
+    b64data = data_url[comma + 1:]
   try:
-    return base64.b64decode(b64data)
+    return pybase64.b64decode(b64data)
   except Exception as exc:
     raise ValueError("Invalid slide image data.") from exc
 
-_cors_origins = _allowed_origins()
+_ALLOWED_ORIGINS: tuple[str, ...] = get_settings().cors_origins or ("http://localhost:3000",)
 app.add_middleware(
   CORSMiddleware,
-  allow_origins=_cors_origins,
-  allow_origin_regex=_allowed_origin_regex(_cors_origins),
+  allow_origins=_ALLOWED_ORIGINS,
+  allow_origin_regex=_allowed_origin_regex(_ALLOWED_ORIGINS),
   allow_credentials=True,
   allow_methods=["*"],
   allow_headers=["*"],
@@ -381,16 +574,34 @@ app.add_middleware(
 @app.on_event("startup")
 def startup():
   init_db()
+  warm_pool()
+  _variant_pool.submit(warm_up_background_removal)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+  await _midtrans_client.aclose()
+  close_pool()
+
+
+# Both payloads are static for the life of the process, so they are
+# validated and serialized once instead of per request.
+_HEALTH_JSON = orjson.dumps(HealthResponse().model_dump())
+_PLANS_JSON = orjson.dumps([PlanItem(**plan.__dict__).model_dump() for plan in get_plan_catalog()])
 
 
 @router.get("/health", response_model=HealthResponse, tags=["system"])
-async def health_check() -> HealthResponse:
-  return HealthResponse()
+async def health_check() -> Response:
+  return Response(content=_HEALTH_JSON, media_type="application/json")
 
 
 @router.get("/plans", response_model=list[PlanItem], tags=["billing"])
-async def list_plans_handler() -> list[PlanItem]:
-  return [PlanItem(**plan.__dict__) for plan in get_plan_catalog()]
+async def list_plans_handler() -> Response:
+  return Response(
+    content=_PLANS_JSON,
+    media_type="application/json",
+    headers={"Cache-Control": "public, max-age=300"},
+  )
 
 
 @router.post("/payments/midtrans/token", response_model=PaymentTokenResponse, tags=["payments"])
@@ -417,7 +628,7 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
     raise HTTPException(status_code=400, detail="Plan not found.")
 
   now_dt = datetime.utcnow()
-  now = now_dt.isoformat() + "Z"
+  now = _iso_now(now_dt)
   order_id = None
   customer_name = name
   customer_email = email
@@ -451,7 +662,7 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
       event = get_latest_payment_event(conn, order_id=order_id, event_type="token_success")
       if event:
         try:
-          event_payload = json.loads(event.get("payload_json") or "{}")
+          event_payload = orjson.loads(event.get("payload_json") or "{}")
         except ValueError:
           event_payload = {}
         recovered_token = event_payload.get("token")
@@ -469,7 +680,7 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
               token=recovered_token,
               redirect_url=event_payload.get("redirect_url"),
             )
-          latest = get_payment_order(conn, order_id)
+          latest = get_payment_order_summary(conn, order_id)
           if latest and latest.get("snap_token"):
             return PaymentTokenResponse(
               order_id=order_id,
@@ -486,7 +697,7 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
         if not claimed:
           raise HTTPException(
             status_code=409,
-            detail="Payment sedang diproses. Coba lagi sebentar.",
+            detail=_order_conflict_detail(get_payment_order(conn, order_id)),
           )
         customer_name = str(existing.get("customer_name") or name)
         customer_email = str(existing.get("customer_email") or email)
@@ -499,11 +710,11 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
         else:
           raise HTTPException(
             status_code=409,
-            detail="Payment sedang diproses. Coba lagi sebentar.",
+            detail=_order_conflict_detail(existing),
           )
     else:
       order_id = _generate_order_id(plan.id)
-      while get_payment_order(conn, order_id):
+      while get_payment_order_summary(conn, order_id):
         order_id = _generate_order_id(plan.id)
       create_payment_order(
         conn,
@@ -525,56 +736,16 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
     raise HTTPException(status_code=500, detail="Failed to initialize payment order.")
 
   if status_check_order_id:
-    status_state, status_payload = _fetch_midtrans_status(settings, status_check_order_id)
-    now = datetime.utcnow().isoformat() + "Z"
-    if status_state == "ok" and status_payload:
-      transaction_status = status_payload.get("transaction_status")
-      fraud_status = status_payload.get("fraud_status")
-      status_code = status_payload.get("status_code")
-      internal_status = _map_midtrans_status(transaction_status, fraud_status)
-      notification_json = json.dumps(status_payload, separators=(",", ":"), ensure_ascii=True)
-      paid_at = status_check_existing.get("paid_at") if status_check_existing else None
-      if internal_status == "PAID" and not paid_at:
-        paid_at = now
-      with db_connection() as conn:
-        insert_payment_event(
-          conn,
-          event_id=str(uuid4()),
-          order_id=str(status_check_order_id),
-          event_type="status_check",
-          payload_json=notification_json,
-          received_at=now,
-        )
-        update_payment_order_status(
-          conn,
-          order_id=str(status_check_order_id),
-          status=internal_status,
-          transaction_status=transaction_status,
-          fraud_status=fraud_status,
-          status_code=str(status_code) if status_code is not None else None,
-          last_notification_json=notification_json,
-          paid_at=paid_at,
-          updated_at=now,
-        )
-      raise HTTPException(
-        status_code=409,
-        detail="Payment sudah dibuat. Silakan cek status pembayaran.",
-      )
-    if status_state == "not_found":
-      with db_connection() as conn:
-        update_payment_order_processing_status(
-          conn,
-          order_id=str(status_check_order_id),
-          status="FAILED",
-          updated_at=now,
-        )
-      raise HTTPException(
-        status_code=409,
-        detail="Payment sebelumnya gagal diproses. Silakan coba lagi.",
+    if status_check_order_id not in _reconciling_orders:
+      _reconciling_orders.add(status_check_order_id)
+      task = asyncio.create_task(
+        _reconcile_stale_order(settings, status_check_order_id, status_check_existing),
       )
+      _background_tasks.add(task)
+      task.add_done_callback(_background_tasks.discard)
     raise HTTPException(
       status_code=409,
-      detail="Payment sedang diproses. Coba lagi sebentar.",
+      detail=_order_conflict_detail(status_check_existing),
     )
 
   first_name, last_name = _split_name(customer_name)
@@ -599,13 +770,13 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
   headers = {
     "Accept": "application/json",
     "Content-Type": "application/json",
-    "Authorization": f"Basic {_midtrans_auth_header(settings.midtrans_server_key)}",
+    "Authorization": _midtrans_auth_header(settings.midtrans_server_key),
   }
-  snap_url = f"{_midtrans_snap_base_url(settings)}/snap/v1/transactions"
+  snap_url = f"{_midtrans_snap_base_url()}/snap/v1/transactions"
   try:
-    response = requests.post(snap_url, headers=headers, json=request_payload, timeout=20)
-  except requests.RequestException as exc:
-    now = datetime.utcnow().isoformat() + "Z"
+    response = await _midtrans_client.post(snap_url, headers=headers, json=request_payload)
+  except httpx.HTTPError as exc:
+    now = _iso_now()
     with db_connection() as conn:
       update_payment_order_processing_status(
         conn,
@@ -615,19 +786,19 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
       )
       insert_payment_event(
         conn,
-        event_id=str(uuid4()),
+        event_id=new_id(),
         order_id=str(order_id),
         event_type="token_failed",
-        payload_json=json.dumps({"error": str(exc)}, separators=(",", ":"), ensure_ascii=True),
+        payload_json=_payload_json({"error": str(exc)}),
         received_at=now,
       )
     raise HTTPException(status_code=502, detail="Failed to reach Midtrans.") from exc
 
   if response.status_code != 201:
     detail = "Midtrans token request failed."
-    error_payload = {"status_code": response.status_code, "body": response.text}
+    error_payload = {"status_code": response.status_code, "body": _body_preview(response)}
     try:
-      body = response.json()
+      body = orjson.loads(response.content)
       error_payload = body
       error_messages = body.get("error_messages")
       if isinstance(error_messages, list):
@@ -637,8 +808,8 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
       elif body.get("message"):
         detail = str(body["message"])
     except ValueError:
-      detail = f"{detail} ({response.text})"
-    now = datetime.utcnow().isoformat() + "Z"
+      detail = f"{detail} ({_body_preview(response)})"
+    now = _iso_now()
     with db_connection() as conn:
       update_payment_order_processing_status(
         conn,
@@ -648,31 +819,30 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
       )
       insert_payment_event(
         conn,
-        event_id=str(uuid4()),
+        event_id=new_id(),
         order_id=str(order_id),
         event_type="token_failed",
-        payload_json=json.dumps(error_payload, separators=(",", ":"), ensure_ascii=True),
+        payload_json=_payload_json(error_payload),
         received_at=now,
       )
     raise HTTPException(status_code=502, detail=detail)
 
-  data = response.json()
+  data = orjson.loads(response.content)
   token = data.get("token")
   if not token:
     raise HTTPException(status_code=502, detail="Midtrans response missing token.")
 
-  now = datetime.utcnow().isoformat() + "Z"
+  now = _iso_now()
   token_payload = {"token": token, "redirect_url": data.get("redirect_url")}
   with db_connection() as conn:
     insert_payment_event(
       conn,
-      event_id=str(uuid4()),
+      event_id=new_id(),
       order_id=str(order_id),
       event_type="token_success",
-      payload_json=json.dumps(token_payload, separators=(",", ":"), ensure_ascii=True),
+      payload_json=_payload_json(token_payload),
       received_at=now,
     )
-  with db_connection() as conn:
     updated = update_payment_order_token(
       conn,
       order_id=order_id,
@@ -680,15 +850,15 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
       updated_at=now,
       status="CREATED",
     )
-    if not updated:
-      existing = get_payment_order(conn, order_id)
-      if existing and existing.get("snap_token"):
-        return PaymentTokenResponse(
-          order_id=order_id,
-          token=existing["snap_token"],
-          redirect_url=None,
-        )
-      raise HTTPException(status_code=409, detail="Payment already created.")
+    existing = None if updated else get_payment_order_summary(conn, order_id)
+  if not updated:
+    if existing and existing.get("snap_token"):
+      return PaymentTokenResponse(
+        order_id=order_id,
+        token=existing["snap_token"],
+        redirect_url=None,
+      )
+    raise HTTPException(status_code=409, detail="Payment already created.")
 
   return PaymentTokenResponse(
     order_id=order_id,
@@ -697,72 +867,34 @@ async def create_midtrans_token(request: Request, payload: PaymentTokenRequest)
   )
 
 
-@router.post("/payments/midtrans/notify", tags=["payments"])
-async def midtrans_notification(request: Request):
-  payload = await request.json()
-  if not isinstance(payload, dict):
-    raise HTTPException(status_code=400, detail="Invalid notification payload.")
-
-  order_id = payload.get("order_id")
-  status_code = payload.get("status_code")
-  gross_amount = payload.get("gross_amount")
-  signature_key = payload.get("signature_key")
-  if not order_id or not status_code or not gross_amount or not signature_key:
-    raise HTTPException(status_code=400, detail="Missing notification fields.")
-
-  settings = get_settings()
-  if not settings.midtrans_server_key:
-    raise HTTPException(status_code=500, detail="Midtrans server key missing.")
-
-  expected = _midtrans_signature(
-    order_id=str(order_id),
-    status_code=str(status_code),
-    gross_amount=str(gross_amount),
-    server_key=settings.midtrans_server_key,
-  )
-  if signature_key != expected:
-    raise HTTPException(status_code=403, detail="Invalid notification signature.")
-
-  transaction_status = payload.get("transaction_status")
-  fraud_status = payload.get("fraud_status")
-  internal_status = _map_midtrans_status(transaction_status, fraud_status)
-  notification_json = json.dumps(payload, separators=(",", ":"), ensure_ascii=True)
-  now_dt = datetime.utcnow()
-  now = now_dt.isoformat() + "Z"
-
-  with db_connection() as conn:
-    insert_payment_event(
+def _apply_midtrans_notification(
+  *,
+  order_id: str,
+  status_code: str,
+  gross_amount,
+  transaction_status: Optional[str],
+  fraud_status: Optional[str],
+  internal_status: str,
+  notification_json: str,
+  now_dt: datetime,
+) -> None:
+  now = _iso_now(now_dt)
+  with db_connection() as conn, write_transaction(conn):
+    order = get_payment_order_summary(conn, str(order_id))
+    event_types = [f"notification:{internal_status.lower()}"]
+    if not order:
+      event_types.append("unknown_order")
+    else:
+      expected_amount = int(order.get("gross_amount") or 0)
+      incoming_amount = _parse_amount(gross_amount)
+      if incoming_amount and expected_amount and incoming_amount != expected_amount:
+        event_types.append("amount_mismatch")
+    insert_payment_events(
       conn,
-      event_id=str(uuid4()),
-      order_id=str(order_id),
-      event_type=f"notification:{internal_status.lower()}",
-      payload_json=notification_json,
-      received_at=now,
+      [(new_id(), str(order_id), event_type, notification_json, now) for event_type in event_types],
     )
-
-    order = get_payment_order(conn, str(order_id))
     if not order:
-      insert_payment_event(
-        conn,
-        event_id=str(uuid4()),
-        order_id=str(order_id),
-        event_type="unknown_order",
-        payload_json=notification_json,
-        received_at=now,
-      )
-      return {"received": True}
-
-    expected_amount = int(order.get("gross_amount") or 0)
-    incoming_amount = _parse_amount(gross_amount)
-    if incoming_amount and expected_amount and incoming_amount != expected_amount:
-      insert_payment_event(
-        conn,
-        event_id=str(uuid4()),
-        order_id=str(order_id),
-        event_type="amount_mismatch",
-        payload_json=notification_json,
-        received_at=now,
-      )
+      return
 
     paid_at = order.get("paid_at")
     if internal_status == "PAID" and not paid_at:
@@ -784,7 +916,11 @@ async def midtrans_notification(request: Request):
       subscription_status = _map_subscription_status(internal_status)
       user_id = str(order["user_id"])
       if subscription_status == "active":
-        existing_period = get_subscription_period_by_order_id(conn, order_id=str(order_id))
+        existing_period, latest_active = get_subscription_period_context(
+          conn,
+          order_id=str(order_id),
+          user_id=user_id,
+        )
         if existing_period:
           if existing_period.get("status") != "active":
             update_subscription_period_status(
@@ -794,14 +930,13 @@ async def midtrans_notification(request: Request):
               updated_at=now,
             )
         else:
-          latest_active = get_latest_active_subscription_period(conn, user_id=user_id)
           started_at, current_period_end = _next_billing_period(
             latest_active.get("period_end") if latest_active else None,
             now_dt,
           )
           create_subscription_period(
             conn,
-            period_id=str(uuid4()),
+            period_id=new_id(),
             user_id=user_id,
             order_id=str(order_id),
             plan_id=order.get("plan_id") or "unknown",
@@ -837,6 +972,50 @@ async def midtrans_notification(request: Request):
               updated_at=now,
             )
 
+
+@router.post("/payments/midtrans/notify", tags=["payments"])
+async def midtrans_notification(request: Request):
+  payload = await request.json()
+  if not isinstance(payload, dict):
+    raise HTTPException(status_code=400, detail="Invalid notification payload.")
+
+  order_id = payload.get("order_id")
+  status_code = payload.get("status_code")
+  gross_amount = payload.get("gross_amount")
+  signature_key = payload.get("signature_key")
+  if not order_id or not status_code or not gross_amount or not signature_key:
+    raise HTTPException(status_code=400, detail="Missing notification fields.")
+
+  settings = get_settings()
+  if not settings.midtrans_server_key:
+    raise HTTPException(status_code=500, detail="Midtrans server key missing.")
+
+  expected = _midtrans_signature(
+    order_id=str(order_id),
+    status_code=str(status_code),
+    gross_amount=str(gross_amount),
+    server_key=settings.midtrans_server_key,
+  )
+  if not hmac.compare_digest(str(signature_key).encode("utf-8"), expected.encode("ascii")):
+    raise HTTPException(status_code=403, detail="Invalid notification signature.")
+
+  transaction_status = payload.get("transaction_status")
+  fraud_status = payload.get("fraud_status")
+  internal_status = _map_midtrans_status(transaction_status, fraud_status)
+  notification_json = _payload_json(payload)
+
+  await run_in_threadpool(
+    _apply_midtrans_notification,
+    order_id=str(order_id),
+    status_code=str(status_code),
+    gross_amount=gross_amount,
+    transaction_status=transaction_status,
+    fraud_status=fraud_status,
+    internal_status=internal_status,
+    notification_json=notification_json,
+    now_dt=datetime.utcnow(),
+  )
+
   return {"received": True}
 
 
@@ -882,7 +1061,7 @@ async def list_projects_handler(request: Request):
 async def create_project_handler(request: Request, payload: dict):
   owner_id = _require_user_id(request)
   name = payload.get("name") or "Untitled project"
-  timestamp = datetime.utcnow().isoformat() + "Z"
+  timestamp = _iso_now()
   with db_connection() as conn:
     project_id = get_or_create_project(
       conn,
@@ -901,7 +1080,7 @@ async def update_project_handler(request: Request, project_id: str, payload: dic
   name = payload.get("name")
   if not name:
     raise HTTPException(status_code=400, detail="Project name required.")
-  timestamp = datetime.utcnow().isoformat() + "Z"
+  timestamp = _iso_now()
   with db_connection() as conn:
     try:
       updated = update_project_name(
@@ -939,8 +1118,8 @@ async def upload_project_slide_image(request: Request, project_id: str, payload:
     image_bytes = _decode_image_data(image_data)
   except ValueError as exc:
     raise HTTPException(status_code=400, detail=str(exc)) from exc
-  image_path = save_slide_image(image_bytes, project_id)
-  updated_at = datetime.utcnow().isoformat() + "Z"
+  image_path = await save_slide_image_async(image_bytes, project_id)
+  updated_at = _iso_now()
   with db_connection() as conn:
     updated = update_project_slide_image(
       conn,
@@ -962,9 +1141,11 @@ async def get_project_slide_image(request: Request, project_id: str):
   if not image_path:
     raise HTTPException(status_code=404, detail="Slide image not found.")
   full_path = (DATA_DIR / image_path).resolve()
-  if not full_path.exists():
-    raise HTTPException(status_code=404, detail="Slide image file missing.")
-  return FileResponse(full_path, media_type="image/png")
+  try:
+    stat_result = full_path.stat()
+  except FileNotFoundError:
+    raise HTTPException(status_code=404, detail="Slide image file missing.") from None
+  return _ImageFileResponse(full_path, media_type="image/png", stat_result=stat_result)
 
 
 @router.delete("/projects/{project_id}/slide-image", tags=["projects"])
@@ -977,7 +1158,7 @@ async def delete_project_slide_image(request: Request, project_id: str):
       owner_id=owner_id,
       project_id=project_id,
       slide_image_path=None,
-      updated_at=datetime.utcnow().isoformat() + "Z",
+      updated_at=_iso_now(),
     )
   if not updated:
     raise HTTPException(status_code=404, detail="Project not found.")
@@ -1025,9 +1206,11 @@ async def get_generation_image(request: Request, generation_id: str):
   if not image_path:
     raise HTTPException(status_code=404, detail="Image not found.")
   full_path = (DATA_DIR / image_path).resolve()
-  if not full_path.exists():
-    raise HTTPException(status_code=404, detail="Image file missing.")
-  return FileResponse(full_path, media_type="image/png")
+  try:
+    stat_result = full_path.stat()
+  except FileNotFoundError:
+    raise HTTPException(status_code=404, detail="Image file missing.") from None
+  return _ImageFileResponse(full_path, media_type="image/png", stat_result=stat_result)
 
 
 @router.post("/generate", tags=["generation"])
@@ -1041,75 +1224,68 @@ async def generate_visuals(request: Request, payload: GenerateRequest):
   owner_id = _require_user_id(request)
 
   async def event_stream():
+    created_at = _iso_now()
     with db_connection() as conn:
-      updated_at = datetime.utcnow().isoformat() + "Z"
       project_id = get_or_create_project(
         conn,
         owner_id=owner_id,
         name=payload.project_name,
-        updated_at=updated_at,
+        updated_at=created_at,
         prompt=payload.prompt or "",
         slide_context=payload.slide_context or "",
       )
 
-      try:
-        prompt_start = perf_counter()
-        final_prompt = genai_client.enhance_prompt(
-          user_prompt=payload.prompt or "",
-          slide_context=payload.slide_context or "",
-          creativity=payload.creativity,
-          slide_image_base64=payload.slide_image_base64,
-        )
-        logger.info("Prompt enhancement took %.2fs", perf_counter() - prompt_start)
-      except ValueError as exc:
-        logger.exception("Prompt enhancement failed")
-        yield _sse_event("error", {"message": str(exc)})
-        return
-
-      logger.info("Original prompt: %s", payload.prompt)
-      logger.info("Enhanced prompt: %s", final_prompt)
-
-      for idx in range(1, payload.variant_count + 1):
-        try:
-          image_start = perf_counter()
-          semi_images = genai_client.generate_images(
-            prompt=final_prompt,
-            aspect_ratio=payload.aspect_ratio,
-            count=1,
-          )
-          logger.info(
-            "Image generation took %.2fs for image %s",
-            perf_counter() - image_start,
-            idx,
-          )
-          raw_image = semi_images[0]
-        except Exception as exc:
-          logger.exception("Image generation failed")
-          yield _sse_event("error", {"message": str(exc)})
-          return
-
-        rembg_start = perf_counter()
+    request_start = perf_counter()
+    try:
+      final_prompt = await run_in_threadpool(
+        genai_client.enhance_prompt,
+        user_prompt=payload.prompt or "",
+        slide_context=payload.slide_context or "",
+        creativity=payload.creativity,
+        slide_image_base64=payload.slide_image_base64,
+      )
+      prompt_seconds = perf_counter() - request_start
+    except ValueError as exc:
+      logger.exception("Prompt enhancement failed")
+      yield _sse_event("error", {"message": str(exc)})
+      return
+
+    logger.info("Original prompt: %s", payload.prompt)
+    logger.info("Enhanced prompt: %s", final_prompt)
+
+    loop = asyncio.get_running_loop()
+    abandoned = threading.Event()
+    variants = [
+      loop.run_in_executor(
+        _variant_pool,
+        _render_variant,
+        final_prompt,
+        payload.aspect_ratio,
+        idx,
+        abandoned,
+      )
+      for idx in range(1, payload.variant_count + 1)
+    ]
+    timings: list[str] = []
+    try:
+      for next_variant in asyncio.as_completed(variants):
         try:
-          transparent = remove_background(raw_image)
+          idx, transparent, encoded, image_seconds, rembg_seconds = await next_variant
         except Exception as exc:
-          logger.exception("Background removal failed")
           yield _sse_event("error", {"message": str(exc)})
           return
-        logger.info("Background removal for image %s took %.2fs", idx, perf_counter() - rembg_start)
-        encoded = base64.b64encode(transparent).decode("ascii")
-        generation_id = str(uuid4())
-        image_path = save_generated_image(transparent, generation_id)
-        created_at = datetime.utcnow().isoformat() + "Z"
-        insert_generation(
-          conn,
-          generation_id=generation_id,
-          project_id=project_id,
-          image_path=image_path,
-          description=final_prompt,
-          aspect_ratio=payload.aspect_ratio,
-          created_at=created_at,
-        )
-        conn.commit()
+        generation_id = new_id()
+        image_path = await save_generated_image_async(transparent, generation_id)
+        with db_connection() as conn:
+          insert_generation(
+            conn,
+            generation_id=generation_id,
+            project_id=project_id,
+            image_path=image_path,
+            description=final_prompt,
+            aspect_ratio=payload.aspect_ratio,
+            created_at=created_at,
+          )
         result_payload = {
           "id": generation_id,
           "image_base64": encoded,
@@ -1118,14 +1294,33 @@ async def generate_visuals(request: Request, payload: GenerateRequest):
           "index": idx,
         }
         yield _sse_event("result", result_payload)
+        timings.append(f"#{idx} {image_seconds:.2f}s+{rembg_seconds:.2f}s")
+    finally:
+      abandoned.set()
+      for variant in variants:
+        variant.cancel()
+      if len(timings) < payload.variant_count:
+        logger.warning(
+          "Generate stream ended after %s of %s images; dropped the rest",
+          len(timings),
+          payload.variant_count,
+        )
 
-      yield _sse_event("done", {"count": payload.variant_count})
+    logger.info(
+      "Generated %s images in %.2fs (prompt %.2fs; image+background %s)",
+      payload.variant_count,
+      perf_counter() - request_start,
+      prompt_seconds,
+      ", ".join(timings),
+    )
+
+    yield _sse_event("done", {"count": payload.variant_count})
 
   return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @router.post("/auth/register", tags=["auth"])
-async def register_user(request: Request, payload: dict):
+async def register_user(request: Request, payload: dict, background_tasks: BackgroundTasks):
   _rate_limit_auth(request, "register")
   email = _normalize_email(payload.get("email") or "")
   username = (payload.get("username") or "").strip()
@@ -1137,25 +1332,27 @@ async def register_user(request: Request, payload: dict):
   if len(password) < 8:
     raise HTTPException(status_code=400, detail="Password must be at least 8 characters.")
 
-  created_at = datetime.utcnow().isoformat() + "Z"
+  password_hash = await hash_password_async(password)
+  created_at = _iso_now()
   with db_connection() as conn:
     if get_user_by_email(conn, email):
       raise HTTPException(status_code=409, detail="Email already exists.")
     if get_user_by_username(conn, username):
       raise HTTPException(status_code=409, detail="Username already exists.")
-    password_hash = hash_password(password)
-    user_id = create_user_with_password(
-      conn,
-      email=email,
-      username=username,
-      password_hash=password_hash,
-      name=username,
-      created_at=created_at,
-    )
-  try:
-    _send_welcome_email(email, username)
-  except Exception as exc:
-    logger.warning("Failed to send welcome email: %s", exc)
+    try:
+      create_user_with_password(
+        conn,
+        email=email,
+        username=username,
+        password_hash=password_hash,
+        name=username,
+        created_at=created_at,
+      )
+    except sqlite3.IntegrityError as exc:
+      # A concurrent registration won the race after the checks above.
+      detail = "Username already exists." if "users.username" in str(exc) else "Email already exists."
+      raise HTTPException(status_code=409, detail=detail) from exc
+  background_tasks.add_task(_send_welcome_email, email, username)
   return {"message": "Account created."}
 
 
@@ -1166,18 +1363,20 @@ async def login_user(request: Request, payload: dict):
   password = payload.get("password") or ""
   if not email or not password:
     raise HTTPException(status_code=400, detail="Email and password required.")
-  now = datetime.utcnow().isoformat() + "Z"
+  now_dt = datetime.utcnow()
+  now = _iso_now(now_dt)
   with db_connection() as conn:
     user = get_user_by_email(conn, email)
-    if not user or not user.get("password_hash"):
-      raise HTTPException(status_code=401, detail="Invalid credentials.")
-    if not verify_password(password, user["password_hash"]):
-      raise HTTPException(status_code=401, detail="Invalid credentials.")
+  if not user or not user.get("password_hash"):
+    raise HTTPException(status_code=401, detail="Invalid credentials.")
+  if not await verify_password_async(password, user["password_hash"]):
+    raise HTTPException(status_code=401, detail="Invalid credentials.")
+  with db_connection() as conn:
     session_token = create_session(
       conn,
       user_id=user["id"],
       created_at=now,
-      expires_at=(datetime.utcnow() + timedelta(days=7)).isoformat() + "Z",
+      expires_at=_iso_now(now_dt + timedelta(days=7)),
     )
   return {
     "token": session_token,
@@ -1188,7 +1387,7 @@ async def login_user(request: Request, payload: dict):
 
 
 @router.post("/auth/forgot-password", tags=["auth"])
-async def forgot_password(request: Request, payload: dict):
+async def forgot_password(request: Request, payload: dict, background_tasks: BackgroundTasks):
   _rate_limit_auth(request, "forgot-password")
   email = _normalize_email(payload.get("email") or "")
   if not _is_valid_email(email):
@@ -1197,16 +1396,16 @@ async def forgot_password(request: Request, payload: dict):
   with db_connection() as conn:
     user = get_user_by_email(conn, email)
     if user and user.get("email_verified"):
+      if not settings.smtp_host or not settings.smtp_from:
+        raise HTTPException(status_code=500, detail="Email service not configured.")
+      now_dt = datetime.utcnow()
       token = create_password_reset_token(
         conn,
         user_id=user["id"],
-        created_at=datetime.utcnow().isoformat() + "Z",
-        expires_at=(datetime.utcnow() + timedelta(hours=settings.reset_token_hours)).isoformat() + "Z",
+        created_at=_iso_now(now_dt),
+        expires_at=_iso_now(now_dt + timedelta(hours=settings.reset_token_hours)),
       )
-      try:
-        _send_reset_email(email, token)
-      except RuntimeError as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+      background_tasks.add_task(_send_reset_email, email, token)
   return {"message": "If an account exists, a reset email has been sent."}
 
 
@@ -1219,12 +1418,12 @@ async def reset_password(request: Request, payload: dict):
     raise HTTPException(status_code=400, detail="Reset token required.")
   if len(password) < 8:
     raise HTTPException(status_code=400, detail="Password must be at least 8 characters.")
-  now = datetime.utcnow().isoformat() + "Z"
-  with db_connection() as conn:
+  password_hash = await hash_password_async(password)
+  now = _iso_now()
+  with db_connection() as conn, write_transaction(conn):
     user_id = consume_password_reset_token(conn, token=token, now=now)
     if not user_id:
       raise HTTPException(status_code=400, detail="Invalid or expired token.")
-    password_hash = hash_password(password)
     update_user_password(conn, user_id, password_hash)
   return {"message": "Password updated."}
 
@@ -14,17 +14,6 @@ class GenerateRequest(BaseModel):
   aspect_ratio: str = Field("square", pattern="^(square|portrait_9x16|landscape_16x9)$")
 
 
-class GeneratedResult(BaseModel):
-  id: str
-  image_base64: str
-  description: str
-  created_at: datetime
-
-
-class GenerateResponse(BaseModel):
-  results: List[GeneratedResult]
-
-
 class HealthResponse(BaseModel):
   status: str = "ok"
   service: str = "odin-server"
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
-import base64
 from typing import List
 
+import pybase64
 from google import genai
 from google.genai import types
 
@@ -34,14 +34,18 @@ def _decode_image_data(data_url: str) -> tuple[str, bytes]:
     raise ValueError("Slide image missing.")
 
   if data_url.startswith("data:"):
-    header, b64data = data_url.split(",", 1)
-    mime = header.split(";")[0].replace("data:", "") or "image/png"
+    comma = data_url.find(",")
+    if comma < 0:
+      raise ValueError("Invalid slide image data.")
+    header = data_url[5:comma]
+    mime = header.partition(";")[0] or "image/png"
+    b64data = data_url[comma + 1:]
   else:
     mime = "image/png"
     b64data = data_url
 
   try:
-    return mime, base64.b64decode(b64data)
+    return mime, pybase64.b64decode(b64data)
   except Exception as exc:  # pragma: no cover
     raise ValueError("Invalid slide image data.") from exc
 
@@ -11,6 +11,8 @@ import numpy as np
 from PIL import Image
 from rembg import new_session, remove
 
+from app.core.config import get_settings
+
 
 MAX_PROCESS_SIDE = 1100
 BACKGROUND_TINT = (160, 160, 160)
@@ -24,7 +26,35 @@ logger = logging.getLogger("odin")
 
 @lru_cache(maxsize=1)
 def _get_isnet_session():
-  return new_session("isnet-general-use", providers=["CPUExecutionProvider"])
+  # onnxruntime comes in through rembg's extras (cpu or gpu build), so it is
+  # not a direct dependency; without it, let rembg pick its own providers.
+  try:
+    import onnxruntime
+  except ImportError:
+    logger.info("onnxruntime not importable; loading IS-Net with rembg defaults")
+    return new_session("isnet-general-use")
+  available = set(onnxruntime.get_available_providers())
+  providers = [p for p in get_settings().rembg_provider_list if p in available]
+  if not providers:
+    providers = ["CPUExecutionProvider"]
+  logger.info("Loading IS-Net session with providers %s", providers)
+  return new_session("isnet-general-use", providers=providers)
+
+
+def warm_up_background_removal() -> None:
+  # Loads the ONNX session and runs one tiny inference so the first
+  # generate request doesn't pay for model load and allocator warm-up.
+  start = perf_counter()
+  try:
+    remove(
+      Image.new("RGBA", (32, 32)),
+      session=_get_isnet_session(),
+      only_mask=True,
+    )
+  except Exception:
+    logger.exception("Background removal warm-up failed")
+    return
+  logger.info("Background removal warm-up took %.2fs", perf_counter() - start)
 
 
 def _pil_to_bgr(image: Image.Image) -> np.ndarray:
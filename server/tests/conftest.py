@@ -0,0 +1,23 @@
+import pytest
+
+from app.core import db as db_module
+
+
+@pytest.fixture
+def db_paths(tmp_path, monkeypatch):
+  # Points db.py at a throwaway data dir with an empty pool and session cache.
+  monkeypatch.setattr(db_module, "DATA_DIR", tmp_path)
+  monkeypatch.setattr(db_module, "DB_PATH", tmp_path / "odin.db")
+  monkeypatch.setattr(db_module, "IMAGES_DIR", tmp_path / "images")
+  monkeypatch.setattr(db_module, "SLIDES_DIR", tmp_path / "slides")
+  db_module.close_pool()
+  db_module._session_cache.clear()
+  yield db_module
+  db_module.close_pool()
+  db_module._session_cache.clear()
+
+
+@pytest.fixture
+def db(db_paths):
+  db_paths.init_db()
+  return db_paths
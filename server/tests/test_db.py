@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def _create_project(db, conn, owner_id: str = "u1") -> str:
+  return db.get_or_create_project(
+    conn,
+    name="deck",
+    owner_id=owner_id,
+    updated_at="2026-01-01T00:00:00Z",
+    prompt="",
+    slide_context="",
+  )
+
+
+def _add_generation(db, conn, project_id: str) -> str:
+  generation_id = db.new_id()
+  db.insert_generation(
+    conn,
+    generation_id=generation_id,
+    project_id=project_id,
+    image_path=f"{generation_id}.png",
+    description="d",
+    aspect_ratio="square",
+    created_at="2026-01-01T00:00:00Z",
+  )
+  return generation_id
+
+
+def _generation_count(conn, project_id: str) -> int:
+  return conn.execute("SELECT generation_count FROM projects WHERE id = ?", (project_id,)).fetchone()["generation_count"]
+
+
+def test_generation_count_follows_inserts_and_deletes(db):
+  with db.db_connection() as conn:
+    project_id = _create_project(db, conn)
+    first = _add_generation(db, conn, project_id)
+    _add_generation(db, conn, project_id)
+    assert _generation_count(conn, project_id) == 2
+
+    conn.execute("DELETE FROM generations WHERE id = ?", (first,))
+    assert _generation_count(conn, project_id) == 1
+    assert db.list_projects(conn, "u1")[0]["generation_count"] == 1
+
+
+_LEGACY_SCHEMA = """
+CREATE TABLE projects (
+  id TEXT PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  last_prompt TEXT,
+  last_slide_context TEXT
+);
+CREATE TABLE generations (
+  id TEXT PRIMARY KEY,
+  project_id TEXT NOT NULL,
+  image_path TEXT NOT NULL,
+  description TEXT NOT NULL,
+  aspect_ratio TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+INSERT INTO projects VALUES ('p1', 'deck', 't', 't', '', '');
+INSERT INTO generations VALUES ('g1', 'p1', 'a.png', 'd', 'square', 't');
+INSERT INTO generations VALUES ('g2', 'p1', 'b.png', 'd', 'square', 't');
+"""
+
+
+def test_init_db_migrates_legacy_schema_and_stamps_version(db_paths):
+  db_paths.DATA_DIR.mkdir(parents=True, exist_ok=True)
+  conn = sqlite3.connect(db_paths.DB_PATH)
+  conn.executescript(_LEGACY_SCHEMA)
+  conn.close()
+
+  db_paths.init_db()
+
+  with db_paths.db_connection() as conn:
+    assert conn.execute("PRAGMA user_version").fetchone()["user_version"] == db_paths._SCHEMA_VERSION
+    project = db_paths.list_projects(conn, "local")[0]
+    assert project["id"] == "p1"
+    assert project["generation_count"] == 2
+
+
+def test_maybe_migrate_skips_databases_at_current_version(db, monkeypatch):
+  def fail(conn):
+    raise AssertionError("schema scanned on an up-to-date database")
+
+  monkeypatch.setattr(db, "_schema_snapshot", fail)
+  db.init_db()
+
+
+def _create_session(db, conn, expires_at: str = "2030-01-01T00:00:00Z") -> tuple[str, str]:
+  user_id = db.create_user_with_password(
+    conn,
+    email="a@example.com",
+    username="alice",
+    password_hash="$2b$12$hash",
+    name="Alice",
+    created_at="2026-01-01T00:00:00Z",
+  )
+  token = db.create_session(conn, user_id=user_id, created_at="2026-01-01T00:00:00Z", expires_at=expires_at)
+  return user_id, token
+
+
+def test_session_cache_expires_after_ttl(db, monkeypatch):
+  clock = [1000.0]
+  monkeypatch.setattr(db.time, "monotonic", lambda: clock[0])
+  now = "2026-01-02T00:00:00Z"
+  with db.db_connection() as conn:
+    user_id, token = _create_session(db, conn)
+    assert db.get_user_id_for_token(conn, token, now) == user_id
+
+    # Another worker deletes the session; this process keeps its cached answer
+    # until the TTL runs out.
+    conn.execute("DELETE FROM sessions")
+    clock[0] += db._SESSION_CACHE_TTL - 1
+    assert db.get_user_id_for_token(conn, token, now) == user_id
+    clock[0] += 2
+    assert db.get_user_id_for_token(conn, token, now) is None
+    assert db._session_cache == {}
+
+
+def test_session_cache_respects_session_expiry(db):
+  with db.db_connection() as conn:
+    user_id, token = _create_session(db, conn, expires_at="2026-01-02T00:00:00Z")
+    assert db.get_user_id_for_token(conn, token, "2026-01-01T12:00:00Z") == user_id
+    assert db.get_user_id_for_token(conn, token, "2026-01-03T00:00:00Z") is None
+
+
+def test_write_transaction_refuses_open_transaction(db):
+  with db.db_connection() as conn:
+    project_id = _create_project(db, conn)
+    assert conn.in_transaction
+    with pytest.raises(RuntimeError):
+      with db.write_transaction(conn):
+        pass
+    # The caller's pending write is neither committed nor discarded.
+    assert conn.in_transaction
+    conn.rollback()
+    assert db.get_project(conn, "u1", project_id) is None
+
+
+def test_write_transaction_rolls_back_on_error(db):
+  with db.db_connection() as conn:
+    with pytest.raises(ValueError):
+      with db.write_transaction(conn):
+        _create_project(db, conn)
+        raise ValueError("boom")
+    assert not conn.in_transaction
+    assert db.list_projects(conn, "u1") == []
+
+
+@pytest.mark.skipif(
+  not {os.open, os.unlink} <= os.supports_dir_fd or not os.path.isdir("/proc/self/fd"),
+  reason="needs dir_fd support and /proc/self/fd",
+)
+def test_dir_fd_race_keeps_one_fd(db, tmp_path, monkeypatch):
+  monkeypatch.setattr(db, "_dir_fds", {})
+  directory = tmp_path / "race"
+  directory.mkdir()
+  open_before = len(os.listdir("/proc/self/fd"))
+  barrier = threading.Barrier(8)
+
+  def grab(_):
+    barrier.wait()
+    return db._dir_fd(directory)
+
+  with ThreadPoolExecutor(max_workers=8) as pool:
+    fds = set(pool.map(grab, range(8)))
+  try:
+    assert fds == {db._dir_fds[directory]}
+    assert len(os.listdir("/proc/self/fd")) == open_before + 1
+  finally:
+    os.close(db._dir_fds.pop(directory))
@@ -0,0 +1,69 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def clock():
+  return SimpleNamespace(now=1_000.0)
+
+
+@pytest.fixture
+def main(monkeypatch, clock):
+  monkeypatch.setenv("GENAI_API_KEY", "test")
+  monkeypatch.setenv("IMAGE_AI_KEY", "test")
+  module = importlib.import_module("app.main")
+  monkeypatch.setattr(module, "time", lambda: clock.now)
+  monkeypatch.setattr(module, "get_settings", lambda: SimpleNamespace(auth_rate_limit_per_minute=3))
+  monkeypatch.setattr(module, "_auth_requests", type(module._auth_requests)())
+  return module
+
+
+def _request(host: str = "10.0.0.1"):
+  return SimpleNamespace(client=SimpleNamespace(host=host))
+
+
+def _hit(main, times: int, host: str = "10.0.0.1") -> None:
+  for _ in range(times):
+    main._rate_limit_auth(_request(host), "login")
+
+
+def _assert_limited(main, host: str = "10.0.0.1") -> None:
+  with pytest.raises(main.HTTPException) as exc_info:
+    main._rate_limit_auth(_request(host), "login")
+  assert exc_info.value.status_code == 429
+
+
+def test_limit_applies_within_one_window(main):
+  _hit(main, 3)
+  _assert_limited(main)
+  # Other actions and other clients keep their own windows.
+  main._rate_limit_auth(_request(), "register")
+  _hit(main, 1, host="10.0.0.2")
+
+
+def test_previous_window_is_weighted_by_overlap(main, clock):
+  _hit(main, 3)
+  # Halfway into the next window the previous 3 requests still count as 1.5.
+  clock.now += 90
+  _hit(main, 2)
+  _assert_limited(main)
+
+
+def test_idle_key_starts_from_zero(main, clock):
+  _hit(main, 3)
+  clock.now += 200
+  _hit(main, 3)
+  _assert_limited(main)
+
+
+def test_table_evicts_least_recently_used_key(main, monkeypatch):
+  monkeypatch.setattr(main, "_AUTH_RATE_MAX_KEYS", 2)
+  _hit(main, 1, host="10.0.0.1")
+  _hit(main, 1, host="10.0.0.2")
+  _hit(main, 1, host="10.0.0.1")
+  _hit(main, 1, host="10.0.0.3")
+  assert list(main._auth_requests) == [("10.0.0.1", "login"), ("10.0.0.3", "login")]
+  assert isinstance(main._auth_requests[("10.0.0.1", "login")], main._RateWindow)
+  assert main._auth_requests[("10.0.0.1", "login")].current == 2